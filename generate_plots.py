@@ -7,6 +7,9 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot
 
+from util import capture
+from util import manifest
+
 
 TcpProbeRecord = collections.namedtuple(
     'TcpProbeRecord',
@@ -219,6 +222,19 @@ def PlotMbpsSummary(ax, tcp_probe_data, bucket_size_ms, end_time_ms,
     ax.set_title(title)
 
 
+def CheckCapture(fname, allow_drops=False):
+  """Exit if the capture stats written next to fname report dropped packets."""
+  stats = capture.load_stats(fname)
+  if stats is None:
+    print '*** Warning: no capture stats for %s, cannot tell if packets were dropped' % fname
+  elif not stats['valid']:
+    msg = ('*** %s is INVALID: %s packets dropped by kernel, %s by interface' %
+           (fname, stats['dropped_kernel'], stats['dropped_iface']))
+    if not allow_drops:
+      sys.exit(msg + ' (pass --allow_capture_drops=True to plot anyway)')
+    print msg
+
+
 def PlotMbps(args):
   if not args.tcpdump:
     return
@@ -226,6 +242,8 @@ def PlotMbps(args):
   num_rows = 2
   if args.skip_instant:
     num_rows = 1
+  for fname in args.tcpdump:
+    CheckCapture(fname, args.allow_capture_drops)
   fig = MakeFig(num_rows, num_cols)
   for i, fname in enumerate(args.tcpdump):
     col = i + 1
@@ -335,11 +353,30 @@ def PlotDrops(args):
   matplotlib.pyplot.savefig(outfile)
 
 
+def ApplyManifests(args):
+  """Locate receiver capture and hosts from run manifests."""
+  manifests = [manifest.load(path) for path in args.manifest]
+  if not args.tcpdump:
+    args.tcpdump = [manifest.run_file(m, m['receiver']['capture'])
+                    for m in manifests]
+  first = manifests[0]
+  if not args.receiver:
+    args.receiver = '%s:%d' % (first['receiver']['ip'], first['receiver']['port'])
+  if not args.outcast_host:
+    outcasts = sorted(f['ip'] for f in first['flows'].itervalues()
+                      if f['hops'] == 2)
+    if outcasts:
+      args.outcast_host = outcasts[0]
+
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--tcpdump', action='append')
   parser.add_argument('--tcpdump_join')
-  parser.add_argument('-r', dest='receiver', required=True)
+  parser.add_argument('--manifest', action='append',
+                      help='Run directory or manifest.json to plot; fills in '
+                           '--tcpdump, -r and --outcast_host when not given.')
+  parser.add_argument('-r', dest='receiver')
   parser.add_argument('-o', dest='out', required=True)
   parser.add_argument('--instant_title', dest='instant_title')
   parser.add_argument('--summary_title', dest='summary_title')
@@ -348,9 +385,17 @@ def main():
   parser.add_argument('--bucket_size_ms', required=True, type=int)
   parser.add_argument('--end_time_ms', required=True, type=int)
   parser.add_argument('--start_time_ms', default=0, type=int)
-  parser.add_argument('--outcast_host', default='10.0.0.2')
+  parser.add_argument('--outcast_host')
+  parser.add_argument('--allow_capture_drops', type=bool, default=False)
   args = parser.parse_args()
 
+  if args.manifest:
+    ApplyManifests(args)
+  if not args.receiver:
+    parser.error('-r is required unless --manifest is given')
+  if not args.outcast_host:
+    args.outcast_host = '10.0.0.2'
+
   PlotMbps(args)
   PlotDrops(args)
 
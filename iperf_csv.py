@@ -0,0 +1,191 @@
+"""Load iperf -yc interval output of a run and cross-check it with tcpdump.
+
+Every client writes iperf_<host>.<i>.txt and the receiver iperf_server.txt,
+one CSV row per second per connection.  Rows are loaded into typed arrays,
+and the per-second goodput of each flow is compared with the series
+ComputeMbps derives from the tcpdump capture at the receiver.  Flows whose
+capture carries less data than iperf reports point to capture loss.
+"""
+
+import argparse
+import array
+import collections
+import glob
+import os
+from multiprocessing.pool import ThreadPool
+
+import generate_plots
+from util import manifest
+
+# Same unit as generate_plots.ComputeMbps.
+ONE_MBIT = float(2**20)
+
+IperfFlow = collections.namedtuple(
+    'IperfFlow',
+    ['key', 'fname', 'local', 'remote', 'start', 'end', 'bytes', 'mbps',
+     'total_bytes'])
+
+FlowCheck = collections.namedtuple(
+    'FlowCheck',
+    ['key', 'iperf_mb', 'tcpdump_mb', 'bad_seconds', 'seconds', 'flagged'])
+
+
+def ParseIperfCsv(fd, fname=None):
+  """Parse iperf -yc -i <n> output into one IperfFlow per connection.
+
+  Rows look like
+    20121201120000,10.0.0.3,40000,10.0.0.2,5001,3,0.0-1.0,1310720,10485760
+  i.e. timestamp, local ip/port, remote ip/port, id, interval, bytes, bits/s.
+  The final row of each connection covers the whole transfer; it is kept as
+  total_bytes rather than as an interval.
+  """
+  rows = collections.OrderedDict()
+  for l in fd:
+    tokens = l.strip().split(',')
+    if len(tokens) < 9:
+      continue
+    try:
+      start, end = [float(x) for x in tokens[6].split('-')]
+      nbytes = int(tokens[7])
+      bps = float(tokens[8])
+    except ValueError:
+      continue
+    local = '%s:%s' % (tokens[1], tokens[2])
+    remote = '%s:%s' % (tokens[3], tokens[4])
+    rows.setdefault((local, remote), []).append((start, end, nbytes, bps))
+
+  result = []
+  for (local, remote), values in rows.iteritems():
+    total = None
+    # Only the first interval and the summary row start at zero.
+    last_start, last_end = values[-1][:2]
+    if last_start == 0.0 and (len(values) > 1 or last_end > 1.5):
+      total = values.pop()[2]
+    flow = IperfFlow(key=None, fname=fname, local=local, remote=remote,
+                     start=array.array('d', [v[0] for v in values]),
+                     end=array.array('d', [v[1] for v in values]),
+                     bytes=array.array('l', [v[2] for v in values]),
+                     mbps=array.array('d', [v[3] / ONE_MBIT for v in values]),
+                     total_bytes=total)
+    result.append(flow)
+  return result
+
+
+def _LoadFile(fname):
+  with open(fname) as fd:
+    return ParseIperfCsv(fd, fname)
+
+
+def LoadIperfRun(run_dir, threads=8):
+  """Load every iperf CSV of a run concurrently.
+
+  Returns (clients, servers): dicts of IperfFlow keyed by the tcpdump flow id
+  '<sender ip:port>-<receiver ip:port>' used by generate_plots.ParseTcpDump.
+  The client list comes from the run manifest when there is one.
+  """
+  try:
+    m = manifest.load(run_dir)
+    client_files = [manifest.run_file(m, f) for flow in m['flows'].itervalues()
+                    for f in flow['files']]
+    server_file = manifest.run_file(m, m['receiver']['file'])
+  except (IOError, ValueError, KeyError):
+    client_files = [f for f in glob.glob(os.path.join(run_dir, 'iperf_*.txt'))
+                    if not f.endswith('iperf_server.txt')]
+    server_file = os.path.join(run_dir, 'iperf_server.txt')
+  fnames = [f for f in client_files + [server_file] if os.path.exists(f)]
+
+  pool = ThreadPool(threads)
+  try:
+    parsed = pool.map(_LoadFile, fnames)
+  finally:
+    pool.close()
+
+  clients = {}
+  servers = {}
+  for fname, flows in zip(fnames, parsed):
+    for flow in flows:
+      if fname == server_file:
+        key = '%s-%s' % (flow.remote, flow.local)
+        servers[key] = flow._replace(key=key)
+      else:
+        key = '%s-%s' % (flow.local, flow.remote)
+        clients[key] = flow._replace(key=key)
+  return clients, servers
+
+
+def CrossCheck(iperf_flows, tcpdump_data, tolerance=0.1, max_bad_fraction=0.2):
+  """Compare per-second iperf goodput with the tcpdump-derived series.
+
+  Each flow's tcpdump series starts at its own first captured packet, and
+  seconds where neither side saw data are ignored.  A flow is flagged if its
+  total volume differs by more than tolerance, or if more than
+  max_bad_fraction of its seconds do.
+
+  Returns a list of FlowCheck, worst disagreement first.
+  """
+  result = []
+  for key, flow in sorted(iperf_flows.iteritems()):
+    records = tcpdump_data.get(key, [])
+    n = len(flow.mbps)
+    if records:
+      start_ms = records[0].timestamp * 1000
+      dump = generate_plots.ComputeMbps(records, 1000, start_ms + 1000 * n,
+                                        start_ms)
+    else:
+      dump = [0.0] * n
+    bad = 0
+    seconds = 0
+    for i in xrange(n):
+      a, b = flow.mbps[i], dump[i]
+      if a == 0 and b == 0:
+        continue
+      seconds += 1
+      if abs(a - b) > tolerance * max(a, b):
+        bad += 1
+    iperf_mb = sum(flow.mbps)
+    dump_mb = sum(dump)
+    total_off = abs(iperf_mb - dump_mb) > tolerance * max(iperf_mb, dump_mb, 1e-9)
+    flagged = total_off or (seconds and float(bad) / seconds > max_bad_fraction)
+    result.append(FlowCheck(key, iperf_mb, dump_mb, bad, seconds, bool(flagged)))
+  result.sort(key=lambda c: -abs(c.iperf_mb - c.tcpdump_mb))
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-d', dest='dir', required=True,
+                      help='Run directory holding iperf_*.txt files.')
+  parser.add_argument('--tcpdump',
+                      help='Receiver capture; taken from the manifest if unset.')
+  parser.add_argument('-r', dest='receiver',
+                      help='Receiver ip:port; taken from the manifest if unset.')
+  parser.add_argument('--tolerance', type=float, default=0.1)
+  parser.add_argument('--max_bad_fraction', type=float, default=0.2)
+  parser.add_argument('--server', type=bool, default=False,
+                      help='Check the receiver-side iperf report instead of '
+                           'the client reports.')
+  args = parser.parse_args()
+
+  if not args.tcpdump or not args.receiver:
+    m = manifest.load(args.dir)
+    args.tcpdump = args.tcpdump or manifest.run_file(m, m['receiver']['capture'])
+    args.receiver = args.receiver or '%s:%d' % (m['receiver']['ip'],
+                                                m['receiver']['port'])
+
+  clients, servers = LoadIperfRun(args.dir)
+  with open(args.tcpdump) as fd:
+    data = generate_plots.ParseTcpDump(fd, lambda x: x.receiver == args.receiver)
+
+  checks = CrossCheck(servers if args.server else clients, data,
+                      args.tolerance, args.max_bad_fraction)
+  print '#flow,iperf_mbit,tcpdump_mbit,bad_seconds,seconds,flagged'
+  for c in checks:
+    print '%s,%0.2f,%0.2f,%d,%d,%s' % (c.key, c.iperf_mb, c.tcpdump_mb,
+                                       c.bad_seconds, c.seconds,
+                                       'FLAGGED' if c.flagged else 'ok')
+  flagged = [c for c in checks if c.flagged]
+  print '# %d of %d flows disagree' % (len(flagged), len(checks))
+
+
+if __name__ == '__main__':
+  main()
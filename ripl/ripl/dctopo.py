@@ -11,15 +11,39 @@ standard Mininet Topo object with layer metadata plus convenience functions to
 enumerate up, down, and layer edges.
 '''
 
+from functools import wraps
+import gc
+
 from mininet.topo import Topo
 
 
 PORT_BASE = 1  # starting index for OpenFlow switch ports
 
 
+def _gc_paused(f):
+    '''Decorator running f with cyclic garbage collection suspended.
+
+    Building a large topology allocates hundreds of thousands of IDs,
+    tuples and lists that all stay live; left running, the collector
+    rescans them over and over.
+    '''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if enabled:
+                gc.enable()
+    return wrapper
+
+
 class NodeID(object):
     '''Topo node identifier.'''
 
+    __slots__ = ('dpid',)
+
     def __init__(self, dpid = None):
         '''Init.
 
@@ -97,6 +121,84 @@ class StructuredTopo(Topo):
         super(StructuredTopo, self).__init__()
         self.node_specs = node_specs
         self.edge_specs = edge_specs
+        self.version = 0  # bumped on every graph change
+        self._layer_nodes = None  # [layer] -> list of names
+        self._up_nodes = None  # [name] -> list of names one layer up
+        self._down_nodes = None  # [name] -> list of names one layer down
+        self._ids_by_name = {}  # [name] -> interned NodeID
+        self._ids_by_dpid = {}  # [dpid] -> interned NodeID
+        self._ports = {}  # [(src, dst)] -> (src_port, dst_port)
+        self._neighbors = {}  # [(dpid, port)] -> neighbor name
+
+    def add_node(self, name, **opts):
+        '''Add node and invalidate precomputed queries.'''
+        self._invalidate()
+        return super(StructuredTopo, self).add_node(name, **opts)
+
+    def add_link(self, node1, node2, *args, **opts):
+        '''Add link and invalidate precomputed queries.'''
+        self._invalidate()
+        return super(StructuredTopo, self).add_link(node1, node2, *args,
+                                                    **opts)
+
+    def _invalidate(self):
+        '''Drop precomputed layer and adjacency lists.'''
+        self.version += 1
+        self._layer_nodes = None
+
+    def _intern(self, node_id):
+        '''Register a node ID so later lookups reuse the same object.
+
+        @param node_id NodeID object
+        @return node_id the interned NodeID for the same dpid
+        '''
+        node_id = self._ids_by_dpid.setdefault(node_id.dpid, node_id)
+        self._ids_by_name[node_id.name_str()] = node_id
+        return node_id
+
+    def node_by_name(self, name):
+        '''Return interned NodeID for a node name, or None.'''
+        return self._ids_by_name.get(name)
+
+    def node_by_dpid(self, dpid):
+        '''Return interned NodeID for a dpid, or None.'''
+        return self._ids_by_dpid.get(dpid)
+
+    def neighbor(self, dpid, port):
+        '''Return name of the node attached to a port, or None.
+
+        @param dpid dpid of switch (or host)
+        @param port port number on that node
+        @return name name of node at the other end of the link
+        '''
+        return self._neighbors.get((dpid, port))
+
+    def _build_index(self):
+        '''Precompute per-layer node lists and up/down adjacency lists.
+
+        Called once after construction, and again after the first query
+        following any graph change.
+        '''
+        layer_of = dict((n, self.node_info[n]['layer'])
+                        for n in self.g.nodes())
+        layer_nodes = dict((l, []) for l in range(len(self.node_specs)))
+        up_nodes = {}
+        down_nodes = {}
+        for n in self.g.nodes():
+            layer = layer_of[n]
+            layer_nodes.setdefault(layer, []).append(n)
+            up = []
+            down = []
+            for m in self.g[n]:
+                if layer_of[m] == layer - 1:
+                    up.append(m)
+                elif layer_of[m] == layer + 1:
+                    down.append(m)
+            up_nodes[n] = up
+            down_nodes[n] = down
+        self._up_nodes = up_nodes
+        self._down_nodes = down_nodes
+        self._layer_nodes = layer_nodes
 
     def def_nopts(self, layer):
         '''Return default dict for a structured topo.
@@ -126,35 +228,32 @@ class StructuredTopo(Topo):
         '''Return nodes at a provided layer.
 
         @param layer layer
-        @return names list of names
+        @return names list of names; shared, do not modify
         '''
-        def is_layer(n):
-            '''Returns true if node is at layer.'''
-            return self.layer(n) == layer
-
-        nodes = [n for n in self.g.nodes() if is_layer(n)]
-        return nodes
+        if self._layer_nodes is None:
+            self._build_index()
+        return self._layer_nodes.get(layer, [])
 
     def up_nodes(self, name):
         '''Return edges one layer higher (closer to core).
 
         @param name name
 
-        @return names list of names
+        @return names list of names; shared, do not modify
         '''
-        layer = self.layer(name) - 1
-        nodes = [n for n in self.g[name] if self.layer(n) == layer]
-        return nodes
+        if self._layer_nodes is None:
+            self._build_index()
+        return self._up_nodes[name]
 
     def down_nodes(self, name):
         '''Return edges one layer higher (closer to hosts).
 
         @param name name
-        @return names list of names
+        @return names list of names; shared, do not modify
         '''
-        layer = self.layer(name) + 1
-        nodes = [n for n in self.g[name] if self.layer(n) == layer]
-        return nodes
+        if self._layer_nodes is None:
+            self._build_index()
+        return self._down_nodes[name]
 
     def up_edges(self, name):
         '''Return edges one layer higher (closer to core).
@@ -218,65 +317,190 @@ class StructuredTopo(Topo):
 #            plt.show()
 
 
-class FatTreeTopo(StructuredTopo):
-    '''Three-layer homogeneous Fat Tree.
+class PodNodeID(NodeID):
+    '''Node identified by (pod, switch, host) coordinates.
 
-    From "A scalable, commodity data center network architecture, M. Fares et
-    al. SIGCOMM 2008."
+    The coordinates are packed one byte each into the dpid; switches use
+    host 1 and hosts start at host 2.
+    '''
+
+    __slots__ = ('pod', 'sw', 'host', '_name')
+
+    def __init__(self, pod = 0, sw = 0, host = 0, dpid = None, name = None):
+        '''Create PodNodeID object from custom params.
+
+        Either (pod, sw, host) or dpid must be passed in.
+
+        @param pod pod ID
+        @param sw switch ID
+        @param host host ID
+        @param dpid optional dpid
+        @param name optional name
+        '''
+        if dpid:
+            self.pod = (dpid & 0xff0000) >> 16
+            self.sw = (dpid & 0xff00) >> 8
+            self.host = (dpid & 0xff)
+            self.dpid = dpid
+        elif name:
+            pod, sw, host = [int(s) for s in name.split('_')]
+            self.pod = pod
+            self.sw = sw
+            self.host = host
+            self.dpid = (pod << 16) + (sw << 8) + host
+        else:
+            self.pod = pod
+            self.sw = sw
+            self.host = host
+            self.dpid = (pod << 16) + (sw << 8) + host
+        self._name = "%i_%i_%i" % (self.pod, self.sw, self.host)
+
+    def __str__(self):
+        return self._name
+
+    def name_str(self):
+        '''Return name string'''
+        return self._name
+
+    def mac_str(self):
+        '''Return MAC string'''
+        return "00:00:00:%02x:%02x:%02x" % (self.pod, self.sw, self.host)
+
+    def IP(self):
+        return self.ip_str()
+
+    def ip_str(self):
+        '''Return IP string'''
+        return "10.%i.%i.%i" % (self.pod, self.sw, self.host)
+
+
+class PodStructuredTopo(StructuredTopo):
+    '''Core/aggregation/edge/host StructuredTopo with PodNodeID nodes.
+
+    Subclasses compute node IDs and link port numbers in closed form and pass
+    them to _build, which adds every node and link exactly once and sets the
+    layer index and port table directly.  id_gen and port are then dict
+    lookups.
     '''
     LAYER_CORE = 0
     LAYER_AGG = 1
     LAYER_EDGE = 2
     LAYER_HOST = 3
 
-    class FatTreeNodeID(NodeID):
+    node_id = PodNodeID  # class of node IDs returned by id_gen
+
+    def _node_name(self, pod, sw, host):
+        '''Return name of an interned node from its coordinates.'''
+        return self._ids_by_dpid[(pod << 16) + (sw << 8) + host]._name
+
+    def _build(self, layer_ids, links):
+        '''Add nodes and links, setting the layer index and port table.
+
+        @param layer_ids list of lists of interned node IDs, one per layer
+            from core to hosts
+        @param links iterable of (lower, upper, lower_port, upper_port)
+            tuples, lower and upper being interned node IDs one layer apart
+        '''
+        # Add each node exactly once, with metadata computed in batch.
+        add_switch = self.add_switch
+        for layer, ids in enumerate(layer_ids[:self.LAYER_HOST]):
+            for n in ids:
+                add_switch(n._name, layer = layer, dpid = "%016x" % n.dpid)
+        add_host = self.add_host
+        layer = self.LAYER_HOST
+        for n in layer_ids[layer]:
+            add_host(n._name, layer = layer, ip = n.ip_str(), mac = n.mac_str(),
+                     dpid = "%016x" % n.dpid)
+
+        layer_nodes = dict((layer, [n._name for n in ids])
+                           for layer, ids in enumerate(layer_ids))
+        up_nodes = {}
+        down_nodes = {}
+        for names in layer_nodes.itervalues():
+            for n in names:
+                up_nodes[n] = []
+                down_nodes[n] = []
+
+        # Up/down adjacency, both port directions and the (dpid, port) ->
+        # neighbor inverse are filled in the pass that adds each link.  The
+        # index is complete at the end, so skip StructuredTopo's per-link
+        # invalidation.
+        add_link = super(StructuredTopo, self).add_link
+        ports = self._ports
+        neighbors = self._neighbors
+        for lower, upper, lower_port, upper_port in links:
+            lower_name = lower._name
+            upper_name = upper._name
+            add_link(lower_name, upper_name)
+            up_nodes[lower_name].append(upper_name)
+            down_nodes[upper_name].append(lower_name)
+            ports[(lower_name, upper_name)] = (lower_port, upper_port)
+            ports[(upper_name, lower_name)] = (upper_port, lower_port)
+            neighbors[(lower.dpid, lower_port)] = upper_name
+            neighbors[(upper.dpid, upper_port)] = lower_name
+        self._layer_nodes = layer_nodes
+        self._up_nodes = up_nodes
+        self._down_nodes = down_nodes
+
+    def id_gen(self, pod = 0, sw = 0, host = 0, dpid = None, name = None):
+        '''Return the node ID for a node.
+
+        Takes the same arguments as PodNodeID.  IDs of nodes in the
+        topology are interned at construction, so this is a dict lookup;
+        IDs of other nodes are built on demand and not cached.
+
+        @param pod pod ID
+        @param sw switch ID
+        @param host host ID
+        @param dpid optional dpid
+        @param name optional name
+        @return node_id object
+        '''
+        if dpid:
+            node_id = self._ids_by_dpid.get(dpid)
+        elif name:
+            node_id = self._ids_by_name.get(name)
+        else:
+            node_id = self._ids_by_dpid.get((pod << 16) + (sw << 8) + host)
+        if node_id is None:
+            node_id = self.node_id(pod, sw, host, dpid, name)
+        return node_id
+
+    def port(self, src, dst):
+        '''Get port number (optional)
+
+        Looks up the table built at construction; pairs outside it fall back
+        to _compute_port.
+
+        @param src source switch DPID
+        @param dst destination switch DPID
+        @return tuple (src_port, dst_port):
+            src_port: port on source switch leading to the destination switch
+            dst_port: port on destination switch leading to the source switch
+        '''
+        ports = self._ports.get((src, dst))
+        if ports is None:
+            ports = self._compute_port(src, dst)
+        return ports
+
+    def _compute_port(self, src, dst):
+        '''Compute port number for a pair missing from the port table.'''
+        raise Exception("Could not find port leading to given dst switch")
+
+
+class FatTreeTopo(PodStructuredTopo):
+    '''Three-layer homogeneous Fat Tree.
+
+    From "A scalable, commodity data center network architecture, M. Fares et
+    al. SIGCOMM 2008."
+    '''
+
+    class FatTreeNodeID(PodNodeID):
         '''Fat Tree-specific node.'''
 
-        def __init__(self, pod = 0, sw = 0, host = 0, dpid = None, name = None):
-            '''Create FatTreeNodeID object from custom params.
-
-            Either (pod, sw, host) or dpid must be passed in.
-
-            @param pod pod ID
-            @param sw switch ID
-            @param host host ID
-            @param dpid optional dpid
-            @param name optional name
-            '''
-            if dpid:
-                self.pod = (dpid & 0xff0000) >> 16
-                self.sw = (dpid & 0xff00) >> 8
-                self.host = (dpid & 0xff)
-                self.dpid = dpid
-            elif name:
-                pod, sw, host = [int(s) for s in name.split('_')]
-                self.pod = pod
-                self.sw = sw
-                self.host = host
-                self.dpid = (pod << 16) + (sw << 8) + host
-            else:
-                self.pod = pod
-                self.sw = sw
-                self.host = host
-                self.dpid = (pod << 16) + (sw << 8) + host
-
-        def __str__(self):
-            return self.name_str()
-
-        def name_str(self):
-            '''Return name string'''
-            return "%i_%i_%i" % (self.pod, self.sw, self.host)
-
-        def mac_str(self):
-            '''Return MAC string'''
-            return "00:00:00:%02x:%02x:%02x" % (self.pod, self.sw, self.host)
-
-        def IP(self):
-            return self.ip_str()
-
-        def ip_str(self):
-            '''Return IP string'''
-            return "10.%i.%i.%i" % (self.pod, self.sw, self.host)
+        __slots__ = ()
+
+    node_id = FatTreeNodeID
     """
     def _add_port(self, src, dst):
         '''Generate port mapping for new edge.
@@ -308,6 +532,7 @@ class FatTreeTopo(StructuredTopo):
         return d
 
 
+    @_gc_paused
     def __init__(self, k = 4, speed = 1.0):
         '''Init.
 
@@ -324,7 +549,6 @@ class FatTreeTopo(StructuredTopo):
         super(FatTreeTopo, self).__init__(node_specs, edge_specs)
 
         self.k = k
-        self.id_gen = FatTreeTopo.FatTreeNodeID
         self.numPods = k
         self.aggPerPod = k / 2
 
@@ -334,36 +558,96 @@ class FatTreeTopo(StructuredTopo):
         edge_sws = range(0, k / 2)
         hosts = range(2, k / 2 + 2)
 
+        # Intern every node ID up front; id_gen then never parses names.
+        new_id = FatTreeTopo.FatTreeNodeID
+        intern = self._intern
+        core_ids = [intern(new_id(k, c_index, c))
+                    for c_index in core_sws for c in core_sws]
+        agg_ids = [intern(new_id(p, a, 1)) for p in pods for a in agg_sws]
+        edge_ids = [intern(new_id(p, e, 1)) for p in pods for e in edge_sws]
+        host_ids = [intern(new_id(p, e, h))
+                    for p in pods for e in edge_sws for h in hosts]
+
+        # Every link exactly once, as (lower, upper, lower_port, upper_port),
+        # with ports from the closed forms in _compute_port.  Nodes are
+        # picked from the lists above by position: i indexes the k/2
+        # switches of a kind within a pod, j the k/2 hosts or uplinks of a
+        # switch.
+        half = k / 2
+        per_pod = range(half)
+        links = []
+        add = links.append
         for p in pods:
-            for e in edge_sws:
-                edge_id = self.id_gen(p, e, 1).name_str()
-                edge_opts = self.def_nopts(self.LAYER_EDGE, edge_id)
-                self.add_switch(edge_id, **edge_opts)
-
-                for h in hosts:
-                    host_id = self.id_gen(p, e, h).name_str()
-                    host_opts = self.def_nopts(self.LAYER_HOST, host_id)
-                    self.add_host(host_id, **host_opts)
-                    self.add_link(host_id, edge_id)
-
-                for a in agg_sws:
-                    agg_id = self.id_gen(p, a, 1).name_str()
-                    agg_opts = self.def_nopts(self.LAYER_AGG, agg_id)
-                    self.add_switch(agg_id, **agg_opts)
-                    self.add_link(edge_id, agg_id)
-
-            for a in agg_sws:
-                agg_id = self.id_gen(p, a, 1).name_str()
-                c_index = a - k / 2 + 1
-                for c in core_sws:
-                    core_id = self.id_gen(k, c_index, c).name_str()
-                    core_opts = self.def_nopts(self.LAYER_CORE, core_id)
-                    self.add_switch(core_id, **core_opts)
-                    self.add_link(core_id, agg_id)
-
+            for i in per_pod:
+                edge = edge_ids[p * half + i]
+                agg = agg_ids[p * half + i]
+                for j in per_pod:
+                    # host <-> edge: host h sits on edge port 2h - 2.
+                    add((host_ids[(p * half + i) * half + j], edge, 0,
+                         2 * j + 2))
+                    # edge <-> agg, within a pod.
+                    add((edge, agg_ids[p * half + j], j * 2 + 1, i * 2 + 2))
+                    # agg <-> core: agg k/2 + i connects to core group i + 1.
+                    add((agg, core_ids[i * half + j], j * 2 + 1, p + 1))
+
+        self._build([core_ids, agg_ids, edge_ids, host_ids], links)
+
+    def path_count(self, src, dst):
+        '''Return number of shortest paths between two edge switches.
+
+        1 for the same switch, k/2 within a pod and (k/2)^2 across pods.
+
+        @param src source edge switch name
+        @param dst destination edge switch name
+        @return count number of paths, or None unless both are edge switches
+        '''
+        if (self.layer(src) != self.LAYER_EDGE or
+            self.layer(dst) != self.LAYER_EDGE):
+            return None
+        if src == dst:
+            return 1
+        half = self.k / 2
+        if self._ids_by_name[src].pod == self._ids_by_name[dst].pod:
+            return half
+        return half * half
+
+    def nth_path(self, src, dst, i):
+        '''Return the i-th shortest path between two edge switches.
+
+        Paths are ordered by switch coordinates: within a pod path i crosses
+        aggregation switch k/2 + i; across pods it goes up through
+        aggregation switch k/2 + i / (k/2) and core switch i % (k/2) of that
+        switch's core group.
+
+        @param src source edge switch name
+        @param dst destination edge switch name
+        @param i path index, 0 <= i < path_count(src, dst)
+        @return path list of names from src to dst
+        '''
+        if src == dst:
+            return [src]
+        half = self.k / 2
+        src_id = self._ids_by_name[src]
+        dst_id = self._ids_by_name[dst]
+        name = self._node_name
+        if src_id.pod == dst_id.pod:
+            return [src, name(src_id.pod, half + i, 1), dst]
+        a, c = divmod(i, half)
+        return [src, name(src_id.pod, half + a, 1), name(self.k, a + 1, c + 1),
+                name(dst_id.pod, half + a, 1), dst]
+
+    def paths(self, src, dst):
+        '''Generate the shortest paths between two edge switches in
+        nth_path order.
+
+        @param src source edge switch name
+        @param dst destination edge switch name
+        '''
+        for i in xrange(self.path_count(src, dst)):
+            yield self.nth_path(src, dst, i)
 
-    def port(self, src, dst):
-        '''Get port number (optional)
+    def _compute_port(self, src, dst):
+        '''Compute port number
 
         Note that the topological significance of DPIDs in FatTreeTopo enables
         this function to be implemented statelessly.
@@ -420,3 +704,154 @@ class FatTreeTopo(StructuredTopo):
 
         return (src_port, dst_port)
   
+
+
+class VL2Topo(PodStructuredTopo):
+    '''Three-layer VL2 Clos network.
+
+    From "VL2: A scalable and flexible data center network, A. Greenberg et
+    al. SIGCOMM 2009."  The da / 2 intermediate switches connect to all di
+    aggregation switches.  Aggregation switches come in pairs, and each pair
+    serves da / 2 ToR switches, every ToR dual-homed to both switches of its
+    pair.
+
+    Pair j is pod j: its ToRs are (j, t, 1) for t < da / 2, its aggregation
+    switches (j, da / 2, 1) and (j, da / 2 + 1, 1).  Intermediate switch i
+    is (di / 2, 1, i), and host h of a ToR is (j, t, h), h >= 2.
+    '''
+
+    @_gc_paused
+    def __init__(self, da = 4, di = 4, hosts = 2, speed = 1.0,
+                 fabric_speed = 10.0):
+        '''Init.
+
+        @param da aggregation switch degree (even)
+        @param di intermediate switch degree (even)
+        @param hosts hosts per ToR switch
+        @param speed bandwidth of host links in Gbps
+        @param fabric_speed bandwidth of switch-to-switch links in Gbps
+        '''
+        core = StructuredNodeSpec(0, di, None, fabric_speed,
+                                  type_str = 'intermediate')
+        agg = StructuredNodeSpec(da / 2, da / 2, fabric_speed, fabric_speed,
+                                 type_str = 'agg')
+        edge = StructuredNodeSpec(2, hosts, fabric_speed, speed,
+                                  type_str = 'tor')
+        host = StructuredNodeSpec(1, 0, speed, None, type_str = 'host')
+        node_specs = [core, agg, edge, host]
+        edge_specs = [StructuredEdgeSpec(fabric_speed),
+                      StructuredEdgeSpec(fabric_speed),
+                      StructuredEdgeSpec(speed)]
+        super(VL2Topo, self).__init__(node_specs, edge_specs)
+
+        self.da = da
+        self.di = di
+        self.hosts_per_tor = hosts
+        self.numPods = di / 2
+
+        pods = range(0, di / 2)
+        ints = range(1, da / 2 + 1)
+        tors = range(0, da / 2)
+        aggs = range(da / 2, da / 2 + 2)
+        host_nums = range(2, hosts + 2)
+
+        new_id = self.node_id
+        intern = self._intern
+        core_ids = [intern(new_id(di / 2, 1, i)) for i in ints]
+        agg_ids = [intern(new_id(j, a, 1)) for j in pods for a in aggs]
+        edge_ids = [intern(new_id(j, t, 1)) for j in pods for t in tors]
+        host_ids = [intern(new_id(j, t, h))
+                    for j in pods for t in tors for h in host_nums]
+
+        # Nodes are picked from the lists above by position.
+        tors_per_pod = da / 2
+        links = []
+        add = links.append
+        for j in pods:
+            for t in tors:
+                tor = edge_ids[j * tors_per_pod + t]
+                # host <-> ToR: host h sits on ToR port 2h - 2.
+                for h in host_nums:
+                    add((host_ids[(j * tors_per_pod + t) * hosts + h - 2],
+                         tor, 0, 2 * h - 2))
+                # ToR <-> both aggregation switches of its pair.
+                for m in (0, 1):
+                    add((tor, agg_ids[2 * j + m], m * 2 + 1, t * 2 + 2))
+            # aggregation <-> every intermediate switch; aggregation switch
+            # 2j + m is on intermediate port 2j + m + 1.
+            for m in (0, 1):
+                for i in ints:
+                    add((agg_ids[2 * j + m], core_ids[i - 1],
+                         (i - 1) * 2 + 1, 2 * j + m + 1))
+
+        self._build([core_ids, agg_ids, edge_ids, host_ids], links)
+
+
+class TreeTopo(PodStructuredTopo):
+    '''Three-layer k-ary multi-rooted tree.
+
+    k pods, each an aggregation switch with k edge switches below it, and
+    roots core switches, each connected to every aggregation switch.  Edge
+    switches are oversubscribed hosts:1 and aggregation switches k:roots,
+    and pods are joined by roots paths; roots = 1 is the plain k-ary tree.
+
+    Edge switch e of pod p is (p, e, 1), the aggregation switch of pod p is
+    (p, k, 1), root r is (k, 1, r) and host h of an edge switch is
+    (p, e, h), h >= 2.
+    '''
+
+    @_gc_paused
+    def __init__(self, k = 4, roots = 2, hosts = None, speed = 1.0):
+        '''Init.
+
+        @param k tree degree: pods, and edge switches per pod
+        @param roots number of core switches
+        @param hosts hosts per edge switch; defaults to k
+        @param speed bandwidth in Gbps
+        '''
+        if hosts is None:
+            hosts = k
+        core = StructuredNodeSpec(0, k, None, speed, type_str = 'core')
+        agg = StructuredNodeSpec(roots, k, speed, speed, type_str = 'agg')
+        edge = StructuredNodeSpec(1, hosts, speed, speed, type_str = 'edge')
+        host = StructuredNodeSpec(1, 0, speed, None, type_str = 'host')
+        node_specs = [core, agg, edge, host]
+        edge_specs = [StructuredEdgeSpec(speed)] * 3
+        super(TreeTopo, self).__init__(node_specs, edge_specs)
+
+        self.k = k
+        self.roots = roots
+        self.hosts_per_edge = hosts
+        self.numPods = k
+
+        pods = range(0, k)
+        root_sws = range(1, roots + 1)
+        edge_sws = range(0, k)
+        host_nums = range(2, hosts + 2)
+
+        new_id = self.node_id
+        intern = self._intern
+        core_ids = [intern(new_id(k, 1, r)) for r in root_sws]
+        agg_ids = [intern(new_id(p, k, 1)) for p in pods]
+        edge_ids = [intern(new_id(p, e, 1)) for p in pods for e in edge_sws]
+        host_ids = [intern(new_id(p, e, h))
+                    for p in pods for e in edge_sws for h in host_nums]
+
+        # Nodes are picked from the lists above by position.
+        links = []
+        add = links.append
+        for p in pods:
+            agg = agg_ids[p]
+            for e in edge_sws:
+                edge = edge_ids[p * k + e]
+                # host <-> edge: host h sits on edge port 2h - 2.
+                for h in host_nums:
+                    add((host_ids[(p * k + e) * hosts + h - 2], edge, 0,
+                         2 * h - 2))
+                # edge <-> agg: one uplink per edge switch.
+                add((edge, agg, 1, e * 2 + 2))
+            # agg <-> every root.
+            for r in root_sws:
+                add((agg, core_ids[r - 1], (r - 1) * 2 + 1, p + 1))
+
+        self._build([core_ids, agg_ids, edge_ids, host_ids], links)
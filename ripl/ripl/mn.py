@@ -7,9 +7,8 @@ To use this file to run a RipL-specific topology on Mininet.  Example:
   sudo mn --custom ~/ripl/ripl/mn.py --topo ft,4
 """
 
-from ripl.dctopo import FatTreeTopo #, VL2Topo, TreeTopo
+from ripl.dctopo import FatTreeTopo, VL2Topo, TreeTopo
 
-topos = { 'ft': FatTreeTopo}
-#,
-#          'vl2': VL2Topo,
-#          'tree': TreeTopo }
+topos = { 'ft': FatTreeTopo,
+          'vl2': VL2Topo,
+          'tree': TreeTopo }
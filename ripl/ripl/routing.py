@@ -5,9 +5,12 @@ Routing engine base class.
 
 @author Brandon Heller (brandonh@stanford.edu)
 '''
+from array import array
 from copy import copy
-from random import choice
+from heapq import heapify, heapreplace
+from random import choice, randrange
 from struct import pack
+from time import time
 from zlib import crc32
 
 import logging
@@ -20,6 +23,116 @@ if DEBUG:
     lg.setLevel(logging.DEBUG)
     lg.addHandler(logging.StreamHandler())
 
+# Instrumentation counters kept by routing engines; see Routing.get_stats.
+STATS = [
+    'routes',  # get_route calls with src != dst
+    'route_sec',  # total time spent in those calls
+    'closed_form',  # routes built by the topology from coordinates
+    'cache_hits',  # routes whose candidate paths were cached
+    'searches',  # frontier searches run
+    'search_sec',  # total time spent searching
+    'paths_explored',  # partial and complete paths built while searching
+    'frontier_nodes',  # frontier sizes summed over search steps
+    'max_frontier',  # largest frontier of a single search step
+]
+
+# (src, dst) pairs whose candidate paths StructuredRouting keeps cached.
+PATH_CACHE_SIZE = 65536
+
+
+class LRUCache(object):
+    '''Mapping that keeps only its size most recently used entries.
+
+    Entries sit in a circular doubly linked list, most recently used last,
+    so get and set are O(1).
+    '''
+
+    def __init__(self, size):
+        '''Create LRUCache object.
+
+        @param size maximum number of entries
+        '''
+        self.size = size
+        self._links = {}  # [key] -> [prev link, next link, key, value]
+        self._root = root = []  # sentinel: next is oldest, prev is newest
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def _touch(self, link):
+        '''Move a link to the most recently used end.'''
+        prev, next_ = link[0], link[1]
+        prev[1] = next_
+        next_[0] = prev
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def get(self, key, default = None):
+        '''Return the value for key, marking it used, or default.'''
+        link = self._links.get(key)
+        if link is None:
+            return default
+        self._touch(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        link = self._links.get(key)
+        if link is not None:
+            link[3] = value
+            self._touch(link)
+            return
+        root = self._root
+        if len(self._links) >= self.size:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self._links[oldest[2]]
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self._links[key] = link
+
+
+class PathSequence(object):
+    '''Candidate paths of a pair enumerated by the topology, built on demand.
+
+    Holds only the path count; indexing calls topo.nth_path, so a cached
+    pair costs the same whatever its number of paths.
+    '''
+
+    __slots__ = ('topo', 'src', 'dst', 'count')
+
+    def __init__(self, topo, src, dst, count):
+        '''Create PathSequence object.
+
+        @param topo topology providing nth_path
+        @param src source node name
+        @param dst destination node name
+        @param count number of paths, from topo.path_count
+        '''
+        self.topo = topo
+        self.src = src
+        self.dst = dst
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('path index out of range')
+        return self.topo.nth_path(self.src, self.dst, i)
+
+    def __iter__(self):
+        nth_path = self.topo.nth_path
+        for i in xrange(self.count):
+            yield nth_path(self.src, self.dst, i)
+
 
 class Routing(object):
     '''Base class for data center network routing.
@@ -33,6 +146,7 @@ class Routing(object):
         @param topo Topo object from Net parent
         '''
         self.topo = topo
+        self.reset_stats()
 
     def get_route(self, src, dst, **kwargs):
         '''Return flow path.
@@ -44,24 +158,143 @@ class Routing(object):
         '''
         raise NotImplementedError
 
+    def reset_stats(self):
+        '''Zero the instrumentation counters.'''
+        self.stats = dict((name, 0) for name in STATS)
+        self.stats['route_sec'] = 0.0
+        self.stats['search_sec'] = 0.0
+
+    def get_stats(self):
+        '''Return instrumentation counters.
+
+        @return stats dict with the STATS counters plus per-call averages
+            avg_route_us, avg_search_us and avg_frontier
+        '''
+        stats = dict(self.stats)
+        routes = stats['routes']
+        searches = stats['searches']
+        stats['avg_route_us'] = (stats['route_sec'] / routes * 1e6
+                                 if routes else 0.0)
+        stats['avg_search_us'] = (stats['search_sec'] / searches * 1e6
+                                  if searches else 0.0)
+        stats['avg_frontier'] = (float(stats['frontier_nodes']) / searches
+                                 if searches else 0.0)
+        return stats
+
 
 class StaticShortestPathRouting(Routing):
+    '''Destination-based static routing for a FatTreeTopo of any k.
+
+    Each host gets a destination id, pod * (k/2)^2 + edge * k/2 + index,
+    index being the host's position on its edge switch.  The low digits of
+    the id, in base k/2, pick the aggregation and core switch that every
+    path toward the host crosses, so load spreads evenly over the core and
+    each switch forwards on the destination alone.
 
-    _PORT_HOST_MAP = {2:0, 4:1}
-    _AGG_SW_DST_BIT_NUM_MAP = {0:2, 1:3}
-    _CORE_SW_DST_BITS_MAP = {0:(1, 1), 1:(2, 1), 2:(1, 2), 3:(2, 2)}
+    Next-hop ports are kept in one dense array per switch, indexed by
+    destination id.  Rows are built on first use, or all at once by
+    precompute(), e.g. before installing every route proactively.
+    '''
 
     def __init__(self, topo):
         super(StaticShortestPathRouting, self).__init__(topo)
+        self.k = topo.k
+        self.half = topo.k / 2
+        self.num_hosts = topo.k ** 3 / 4
+        self._typecode = 'B' if topo.k < 256 else 'H'
+        self._rows = {}  # [switch name] -> next-hop ports by destination id
+        self._rows_version = getattr(topo, 'version', None)
 
     def _get_host_destination_id(self, dst_sw, dst_port):
         """Each end host is assigned a destination id which helps in choosing
         a path to that host. IP or MAC addresses don't help as their distribution
         is not uniform.
+
+        Host h of an edge switch sits on port 2h - 2, so its index there is
+        port / 2 - 1.
         """
-        return ((dst_sw.pod * self.topo.k * self.topo.k / 4) +
-                dst_sw.sw * self.topo.k/2 +
-                self._PORT_HOST_MAP[dst_port])
+        half = self.half
+        return dst_sw.pod * half * half + dst_sw.sw * half + dst_port / 2 - 1
+
+    def destination_id(self, host):
+        '''Return destination id of a host.
+
+        @param host host name
+        @return dst_id integer in [0, k^3/4)
+        '''
+        host_id = self.topo.id_gen(name = host)
+        half = self.half
+        return host_id.pod * half * half + host_id.sw * half + host_id.host - 2
+
+    def _next_hop(self, sw, dst_id):
+        '''Return name of the next node from a switch toward a host.
+
+        @param sw switch name
+        @param dst_id destination id of the host
+        @return name of a neighbor of sw
+        '''
+        topo = self.topo
+        half = self.half
+        sw_id = topo.id_gen(name = sw)
+        pod, rest = divmod(dst_id, half * half)
+        edge, index = divmod(rest, half)
+        layer = topo.layer(sw)
+        if layer == topo.LAYER_CORE:
+            next_id = topo.id_gen(pod = pod, sw = sw_id.sw + half - 1, host = 1)
+        elif layer == topo.LAYER_AGG:
+            if sw_id.pod == pod:
+                next_id = topo.id_gen(pod = pod, sw = edge, host = 1)
+            else:
+                next_id = topo.id_gen(pod = self.k, sw = sw_id.sw - half + 1,
+                                      host = 1 + dst_id / half % half)
+        elif sw_id.pod == pod and sw_id.sw == edge:
+            next_id = topo.id_gen(pod = pod, sw = edge, host = index + 2)
+        else:
+            next_id = topo.id_gen(pod = sw_id.pod, sw = half + dst_id % half,
+                                  host = 1)
+        return next_id.name_str()
+
+    def _row(self, sw):
+        '''Return the next-hop port array of a switch, building it once.
+
+        @param sw switch name
+        @return row array of out ports indexed by destination id
+        '''
+        if getattr(self.topo, 'version', None) != self._rows_version:
+            self._rows = {}
+            self._rows_version = getattr(self.topo, 'version', None)
+        row = self._rows.get(sw)
+        if row is None:
+            ports = {}  # [next hop] -> out port; few distinct per switch
+            port = self.topo.port
+            row = array(self._typecode)
+            for dst_id in xrange(self.num_hosts):
+                next_hop = self._next_hop(sw, dst_id)
+                out_port = ports.get(next_hop)
+                if out_port is None:
+                    out_port = ports[next_hop] = port(sw, next_hop)[0]
+                row.append(out_port)
+            self._rows[sw] = row
+        return row
+
+    def next_port(self, sw, dst_id):
+        '''Return out port of a switch toward a host.
+
+        @param sw switch name
+        @param dst_id destination id of the host
+        @return out_port port number
+        '''
+        return self._row(sw)[dst_id]
+
+    def precompute(self):
+        '''Build the next-hop rows of every switch.
+
+        @return rows dict of switch name to array of out ports indexed by
+            destination id
+        '''
+        for sw in self.topo.switches():
+            self._row(sw)
+        return self._rows
 
     def get_route(self, src, dst, **kwargs):
         #lg.info('src: %s' % src)
@@ -69,6 +302,7 @@ class StaticShortestPathRouting(Routing):
         if src == dst:
             return [src]
 
+        self.stats['routes'] += 1
         src_sw = self.topo.id_gen(name=src)
         dst_sw = self.topo.id_gen(name=dst)
 
@@ -76,12 +310,12 @@ class StaticShortestPathRouting(Routing):
         dst_id = self._get_host_destination_id(dst_sw, out_port)
         #lg.info('Destination host id: %d' % dst_id)
         
+        half = self.half
         path = [src]
 
         if self.topo.layer(src) == self.topo.LAYER_EDGE:
             # Choose the aggregation switch.
-            agg_sw = self.topo.id_gen(pod=src_sw.pod,
-                                      sw=self._AGG_SW_DST_BIT_NUM_MAP[dst_id % 2],
+            agg_sw = self.topo.id_gen(pod=src_sw.pod, sw=half + dst_id % half,
                                       host=1)
             path.append(agg_sw.name_str())
         if src_sw.pod == dst_sw.pod:
@@ -90,13 +324,14 @@ class StaticShortestPathRouting(Routing):
 
         if self.topo.layer(src) != self.topo.LAYER_CORE:
             # Choose the core switch.
-            core_sw_num = self._CORE_SW_DST_BITS_MAP[dst_id % 4]
-            core_sw = self.topo.id_gen(pod=4, sw=core_sw_num[0], host=core_sw_num[1])
+            core_sw = self.topo.id_gen(pod=self.k, sw=1 + dst_id % half,
+                                       host=1 + dst_id / half % half)
             path.append(core_sw.name_str())
         else:
             core_sw = src_sw
 
-        dst_agg_sw = self.topo.id_gen(pod=dst_sw.pod, sw=core_sw.sw+1, host=1)
+        dst_agg_sw = self.topo.id_gen(pod=dst_sw.pod, sw=core_sw.sw + half - 1,
+                                      host=1)
         path.append(dst_agg_sw.name_str())
         path.append(dst)
         return path
@@ -124,20 +359,45 @@ class StructuredRouting(Routing):
     (src or dst) to the key.
 
     Invariant: the last element in each route must be equal to the key.
+
+    The candidate paths found for the cache_size most recently routed
+    (src, dst) pairs are cached until the topology version changes, so the
+    search runs once per pair and only path_choice runs per request.
+
+    Topologies that can enumerate paths from node coordinates provide
+    path_count(src, dst), which returns None for pairs they cannot handle,
+    and nth_path(src, dst, i).  For those pairs no search is needed: only the
+    count is cached, in a PathSequence that builds paths as they are indexed,
+    and an engine given a path_index function builds only the path it picks.
     '''
 
-    def __init__(self, topo, path_choice):
+    def __init__(self, topo, path_choice, path_index = None,
+                 cache_size = PATH_CACHE_SIZE):
         '''Create Routing object.
 
         @param topo Topo object
         @param path_choice path choice function (see examples below)
+        @param path_index optional function (count, src, dst) -> index of the
+            path path_choice would pick among count candidates
+        @param cache_size number of (src, dst) pairs whose paths are cached
         '''
         self.topo = topo
         self.path_choice = path_choice
+        self.path_index = path_index
         self.src_paths = None
         self.dst_paths = None
         self.src_path_layer = None
         self.dst_path_layer = None
+        self.cache_size = cache_size
+        # [(src, dst)] -> list or PathSequence of candidate paths
+        self._path_cache = LRUCache(cache_size)
+        self._path_cache_version = getattr(topo, 'version', None)
+        self.reset_stats()
+
+    def invalidate(self):
+        '''Drop all cached candidate paths.'''
+        self._path_cache = LRUCache(self.cache_size)
+        self._path_cache_version = getattr(self.topo, 'version', None)
 
     def _extend_reachable(self, frontier_layer):
         '''Extend reachability up, closer to core.
@@ -157,6 +417,9 @@ class StructuredRouting(Routing):
         '''
 
         complete_paths = [] # List of complete dpid routes
+        trace = lg.isEnabledFor(logging.DEBUG)
+        explored = 0 # partial paths built
+        frontier = 0 # nodes on the new src and dst frontiers
 
         # expand src frontier if it's below the dst
         if self.src_path_layer > frontier_layer:
@@ -166,8 +429,9 @@ class StructuredRouting(Routing):
             for node in sorted(self.src_paths):
 
                 src_path_list = self.src_paths[node]
-                lg.info("src path list for node %s is %s" %
-                        (node, src_path_list))
+                if trace:
+                    lg.debug("src path list for node %s is %s", node,
+                             src_path_list)
                 if not src_path_list or len(src_path_list) == 0:
                     continue
                 last = src_path_list[0][-1] # Last element on first list
@@ -189,14 +453,16 @@ class StructuredRouting(Routing):
                     # add path if it connects the src and dst
                     if frontier_node in self.dst_paths:
                         dst_path_list = self.dst_paths[frontier_node]
-                        lg.info('self.dst_paths[frontier_node] = %s' %
-                                self.dst_paths[frontier_node])
+                        if trace:
+                            lg.debug('self.dst_paths[frontier_node] = %s',
+                                     dst_path_list)
                         for dst_path in dst_path_list:
                             dst_path_rev = copy(dst_path)
                             dst_path_rev.reverse()
                             for src_path in src_path_list:
                                 new_path = src_path + dst_path_rev
-                                lg.info('adding path: %s' % new_path)
+                                if trace:
+                                    lg.debug('adding path: %s', new_path)
                                 complete_paths.append(new_path)
                     else:
                         if frontier_node not in src_paths_next:
@@ -204,11 +470,15 @@ class StructuredRouting(Routing):
                         for src_path in src_path_list:
                             extended_path = src_path + [frontier_node]
                             src_paths_next[frontier_node].append(extended_path)
-                            lg.info("adding to self.paths[%s] %s: " % \
-                                      (frontier_node, extended_path))
+                            explored += 1
+                            if trace:
+                                lg.debug("adding to self.paths[%s] %s: ",
+                                         frontier_node, extended_path)
 
             # filter paths to only those in the most recently seen layer
-            lg.info("src_paths_next: %s" % src_paths_next)
+            if trace:
+                lg.debug("src_paths_next: %s", src_paths_next)
+            frontier += len(src_paths_next)
             self.src_paths = src_paths_next
             self.src_path_layer -= 1
 
@@ -220,8 +490,9 @@ class StructuredRouting(Routing):
             for node in self.dst_paths:
 
                 dst_path_list = self.dst_paths[node]
-                lg.info("dst path list for node %s is %s" %
-                        (node, dst_path_list))
+                if trace:
+                    lg.debug("dst path list for node %s is %s", node,
+                             dst_path_list)
                 last = dst_path_list[0][-1] # last element on first list
 
                 up_edges = self.topo.up_edges(last)
@@ -232,7 +503,8 @@ class StructuredRouting(Routing):
                 if not up_nodes:
                     continue
                 assert up_nodes
-                lg.info("up_edges = %s" % sorted(up_edges))
+                if trace:
+                    lg.debug("up_edges = %s", sorted(up_edges))
                 for edge in sorted(up_edges):
                     a, b = edge
                     assert a == last
@@ -241,14 +513,16 @@ class StructuredRouting(Routing):
                     # add path if it connects the src and dst
                     if frontier_node in self.src_paths:
                         src_path_list = self.src_paths[frontier_node]
-                        lg.info('self.src_paths[frontier_node] = %s' %
-                                self.src_paths[frontier_node])
+                        if trace:
+                            lg.debug('self.src_paths[frontier_node] = %s',
+                                     src_path_list)
                         for src_path in src_path_list:
                             for dst_path in dst_path_list:
                                 dst_path_rev = copy(dst_path)
                                 dst_path_rev.reverse()
                                 new_path = src_path + dst_path_rev
-                                lg.info('adding path: %s' % new_path)
+                                if trace:
+                                    lg.debug('adding path: %s', new_path)
                                 complete_paths.append(new_path)
 
                     else:
@@ -257,28 +531,61 @@ class StructuredRouting(Routing):
                         for dst_path in dst_path_list:
                             extended_path = dst_path + [frontier_node]
                             dst_paths_next[frontier_node].append(extended_path)
-                            lg.info("adding to self.paths[%s] %s: " % \
-                                      (frontier_node, extended_path))
+                            explored += 1
+                            if trace:
+                                lg.debug("adding to self.paths[%s] %s: ",
+                                         frontier_node, extended_path)
 
             # filter paths to only those in the most recently seen layer
-            lg.info("dst_paths_next: %s" % dst_paths_next)
+            if trace:
+                lg.debug("dst_paths_next: %s", dst_paths_next)
+            frontier += len(dst_paths_next)
             self.dst_paths = dst_paths_next
             self.dst_path_layer -= 1
 
-        lg.info("complete paths = %s" % complete_paths)
+        if trace:
+            lg.debug("complete paths = %s", complete_paths)
+        stats = self.stats
+        stats['paths_explored'] += explored + len(complete_paths)
+        stats['frontier_nodes'] += frontier
+        if frontier > stats['max_frontier']:
+            stats['max_frontier'] = frontier
         return complete_paths
 
-    def get_route(self, src, dst, **kwargs):
-        '''Return flow path.
+    def get_paths(self, src, dst):
+        '''Return all candidate paths between two nodes.
 
         @param src source dpid (for host or switch)
         @param dst destination dpid (for host or switch)
 
-        @return flow_path list of DPIDs to traverse (including inputs), or None
+        @return paths list (or PathSequence) of paths, each a list of DPIDs
+            including inputs; cached and shared, do not modify
         '''
+        if getattr(self.topo, 'version', None) != self._path_cache_version:
+            self.invalidate()
+        paths = self._path_cache.get((src, dst))
+        if paths is None:
+            paths = self._find_paths(src, dst)
+            self._path_cache[(src, dst)] = paths
+        else:
+            self.stats['cache_hits'] += 1
+        return paths
+
+    def _find_paths(self, src, dst):
+        '''Search the topology for all candidate paths.
 
+        @param src source dpid (for host or switch)
+        @param dst destination dpid (for host or switch)
+
+        @return paths list of paths, empty if there is none, or a
+            PathSequence if the topology enumerates them itself
+        '''
         if src == dst:
-          return [src]
+          return [[src]]
+
+        count = self._path_count(src, dst)
+        if count is not None:
+            return PathSequence(self.topo, src, dst, count)
 
         self.src_paths = {src: [[src]]}
         self.dst_paths = {dst: [[dst]]}
@@ -295,14 +602,55 @@ class StructuredRouting(Routing):
         if dst_layer > src_layer:
             lowest_starting_layer = dst_layer
 
+        start = time()
+        self.stats['searches'] += 1
+        paths_found = []
         for depth in range(lowest_starting_layer - 1, -1, -1):
-            lg.info('-------------------------------------------')
+            lg.debug('-------------------------------------------')
             paths_found = self._extend_reachable(depth)
             if paths_found:
-                path_choice = self.path_choice(paths_found, src, dst)
-                lg.info('path_choice = %s' % path_choice)
-                return path_choice
-        return None
+                break
+        self.stats['search_sec'] += time() - start
+        return paths_found
+
+    def _path_count(self, src, dst):
+        '''Return number of paths if the topology enumerates them itself.'''
+        path_count = getattr(self.topo, 'path_count', None)
+        if path_count is None:
+            return None
+        return path_count(src, dst)
+
+    def get_route(self, src, dst, **kwargs):
+        '''Return flow path.
+
+        @param src source dpid (for host or switch)
+        @param dst destination dpid (for host or switch)
+
+        @return flow_path list of DPIDs to traverse (including inputs), or None
+        '''
+
+        if src == dst:
+          return [src]
+
+        start = time()
+        stats = self.stats
+        stats['routes'] += 1
+        path_choice = None
+        count = None
+        if self.path_index is not None:
+            count = self._path_count(src, dst)
+        if count:
+            stats['closed_form'] += 1
+            path_choice = self.topo.nth_path(src, dst,
+                                             self.path_index(count, src, dst))
+        else:
+            paths = self.get_paths(src, dst)
+            if paths:
+                path_choice = self.path_choice(paths, src, dst)
+        if lg.isEnabledFor(logging.DEBUG):
+            lg.debug('path_choice = %s', path_choice)
+        stats['route_sec'] += time() - start
+        return path_choice
 
 # Disable unused argument warnings in the classes below
 # pylint: disable-msg=W0613
@@ -326,7 +674,12 @@ class STStructuredRouting(StructuredRouting):
             '''
             return paths[0]
 
-        super(STStructuredRouting, self).__init__(topo, choose_leftmost)
+        def index_leftmost(count, src, dst):
+            '''Index of the leftmost path'''
+            return 0
+
+        super(STStructuredRouting, self).__init__(topo, choose_leftmost,
+                                                  index_leftmost)
 
 
 class RandomStructuredRouting(StructuredRouting):
@@ -347,7 +700,12 @@ class RandomStructuredRouting(StructuredRouting):
             '''
             return choice(paths)
 
-        super(RandomStructuredRouting, self).__init__(topo, choose_random)
+        def index_random(count, src, dst):
+            '''Index of a random path'''
+            return randrange(count)
+
+        super(RandomStructuredRouting, self).__init__(topo, choose_random,
+                                                      index_random)
 
 
 class HashedStructuredRouting(StructuredRouting):
@@ -366,11 +724,171 @@ class HashedStructuredRouting(StructuredRouting):
             @param src src dpid
             @param dst dst dpid
             '''
+            return paths[index_hashed(len(paths), src, dst)]
+
+        def index_hashed(count, src, dst):
+            '''Index of the consistent hashed path
+
+            @param count number of candidate paths
+            @param src src dpid
+            @param dst dst dpid
+            '''
             src_dpid = self.topo.id_gen(name = src).dpid
             dst_dpid = self.topo.id_gen(name = dst).dpid
             hash_ = crc32(pack('QQ', src_dpid, dst_dpid))
-            path = paths[hash_ % len(paths)]
-            return path
+            return hash_ % count
+
+        super(HashedStructuredRouting, self).__init__(topo, choose_hashed,
+                                                      index_hashed)
+
+
+class ECMPStructuredRouting(HashedStructuredRouting):
+    '''5-tuple Hashed Structured Routing.
+
+    Spreads the flows between two switches over all their paths, as ECMP
+    hashing does in switches: the path is picked by the CRC of the flow's
+    5-tuple, passed to get_route as five_tuple bytes.  On topologies that
+    enumerate paths themselves a route costs one CRC, path_count and one
+    nth_path; on others, one CRC and one index into the cached candidates.
+    Routes without a 5-tuple are hashed on the switch pair.
+    '''
+
+    def get_route(self, src, dst, five_tuple = None, **kwargs):
+        '''Return flow path.
+
+        @param src source dpid (for host or switch)
+        @param dst destination dpid (for host or switch)
+        @param five_tuple bytes identifying the flow, e.g. IP protocol,
+            addresses and ports
+
+        @return flow_path list of DPIDs to traverse (including inputs), or None
+        '''
+        if five_tuple is None or src == dst:
+            return super(ECMPStructuredRouting, self).get_route(src, dst,
+                                                                **kwargs)
+        start = time()
+        stats = self.stats
+        stats['routes'] += 1
+        count = self._path_count(src, dst)
+        if count:
+            stats['closed_form'] += 1
+            path = self.topo.nth_path(src, dst, crc32(five_tuple) % count)
+        else:
+            paths = self.get_paths(src, dst)
+            path = paths[crc32(five_tuple) % len(paths)] if paths else None
+        stats['route_sec'] += time() - start
+        return path
+
+
+class LoadAwareStructuredRouting(StructuredRouting):
+    '''Load-aware Structured Routing.
+
+    Chooses the candidate path whose busiest link carries the least traffic,
+    breaking ties by the total over its links.
+    A link's load is its transmit rate, estimated from port counters that the
+    controller feeds in through update_port_stats(), plus flow_rate for each
+    flow placed on the link since that link's last counter update, so a
+    burst of new flows spreads out before the next poll.
 
-        super(HashedStructuredRouting, self).__init__(topo, choose_hashed)
+    Each (src, dst) pair keeps a heap of (cost, index) over its candidate
+    paths.  Placing flows only raises costs, so a stored cost is a lower
+    bound: the top is popped, re-costed, and taken once its cost is
+    unchanged.  Only a drop in some link's rate makes pairs re-heapify,
+    lazily on their next request.
+    '''
+
+    def __init__(self, topo, flow_rate = 125000.0, alpha = 0.5):
+        '''Create StructuredRouting object.
+
+        @param topo Topo object
+        @param flow_rate load in bytes/s charged to a link per placed flow
+            until the next counter update of that link
+        @param alpha weight of the newest sample in the moving average rate
+        '''
+        super(LoadAwareStructuredRouting, self).__init__(
+            topo, self._choose_least_loaded)
+        self.flow_rate = flow_rate
+        self.alpha = alpha
+        self._rates = {}  # [(node, next node)] -> tx bytes/s estimate
+        self._placed = {}  # [(node, next node)] -> flows since last update
+        self._counters = {}  # [(dpid, port)] -> (tx_bytes, time) last seen
+        # [(src, dst)] -> (epoch, heap of (cost, index)), as many pairs as
+        # there are cached paths
+        self._heaps = LRUCache(self.cache_size)
+        self._epoch = 0  # bumped whenever a link cost drops
+
+    def invalidate(self):
+        '''Drop all cached candidate paths and their heaps.'''
+        super(LoadAwareStructuredRouting, self).invalidate()
+        self._heaps = LRUCache(self.cache_size)
+
+    def _link_cost(self, link):
+        '''Return load estimate in bytes/s of a directed link.'''
+        return (self._rates.get(link, 0.0) +
+                self._placed.get(link, 0) * self.flow_rate)
+
+    def _path_cost(self, path):
+        '''Return (busiest link load, total link load) of a path.'''
+        costs = [self._link_cost(link) for link in zip(path, path[1:])]
+        return (max(costs), sum(costs))
+
+    def _choose_least_loaded(self, paths, src, dst):
+        '''Choose least loaded path and charge a flow to its links
+
+        @param path paths of dpids generated by a routing engine
+        @param src src dpid
+        @param dst dst dpid
+        '''
+        entry = self._heaps.get((src, dst))
+        if entry is None or entry[0] != self._epoch:
+            heap = [(self._path_cost(p), i) for i, p in enumerate(paths)]
+            heapify(heap)
+            self._heaps[(src, dst)] = (self._epoch, heap)
+        else:
+            heap = entry[1]
+        path_cost = self._path_cost
+        while True:
+            cost, i = heap[0]
+            new_cost = path_cost(paths[i])
+            if new_cost == cost:
+                break
+            heapreplace(heap, (new_cost, i))
+        path = paths[i]
+        placed = self._placed
+        for link in zip(path, path[1:]):
+            placed[link] = placed.get(link, 0) + 1
+        heapreplace(heap, (path_cost(path), i))
+        return path
+
+    def update_port_stats(self, dpid, port, tx_bytes, now):
+        '''Update the load estimate of a link from a port counter sample.
+
+        @param dpid dpid of the switch reporting the counter
+        @param port port number
+        @param tx_bytes bytes transmitted on the port so far
+        @param now time of the sample in seconds
+        '''
+        neighbor = self.topo.neighbor(dpid, port)
+        if neighbor is None:
+            return
+        last = self._counters.get((dpid, port))
+        self._counters[(dpid, port)] = (tx_bytes, now)
+        if last is None or now <= last[1] or tx_bytes < last[0]:
+            return
+        link = (self.topo.id_gen(dpid = dpid).name_str(), neighbor)
+        old_cost = self._link_cost(link)
+        sample = (tx_bytes - last[0]) / (now - last[1])
+        rate = self._rates.get(link, 0.0)
+        self._rates[link] = rate + self.alpha * (sample - rate)
+        self._placed.pop(link, None)
+        if self._link_cost(link) < old_cost:
+            self._epoch += 1
+
+    def link_loads(self):
+        '''Return load estimates in bytes/s of links seen so far.
+
+        @return loads dict of (node, next node) to bytes/s
+        '''
+        links = set(self._rates) | set(self._placed)
+        return dict((link, self._link_cost(link)) for link in links)
 # pylint: enable-msg=W0613
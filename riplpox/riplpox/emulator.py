@@ -0,0 +1,429 @@
+"""
+Controller-only emulation of a RipL topology, for benchmarking RipL-POX.
+
+Every switch of the controller's topology is a software switch
+(pox.openflow.switch_impl.SwitchImpl) living in the POX process, connected
+to the OpenFlow stack through an in-memory pipe instead of TCP and wired to
+its neighbors per Topo.port().  Synthetic host traffic is replayed as
+packet-ins, and flow-setup rate and latency are reported.  No Mininet, no
+sockets, so k=16 and larger fat trees fit on one machine:
+
+  ~/pox/pox.py --no-cli log.level --WARNING \
+    riplpox.riplpox --topo=ft,16 --routing=hashed \
+    riplpox.emulator --flows=5000 --burst=100 --out=bench.json
+
+Each synthetic flow is the first (TCP SYN) packet between two random hosts,
+so it always misses in the switch and goes to the controller.  A flow is set
+up once the controller has delivered that packet out of the destination
+host's port, directly or by forwarding it along installed entries.
+"""
+
+from time import time
+import json
+import random
+import struct
+
+from pox.core import core
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.of_01 import Connection
+from pox.openflow.switch_impl import SwitchImpl, DpPacketOut
+
+log = core.getLogger()
+
+# Flow i uses TCP ports (FIRST_SPORT + i % SPORTS, FIRST_DPORT + i / SPORTS).
+FIRST_SPORT = 1024
+SPORTS = 60000
+FIRST_DPORT = 5001
+
+NO_BUFFER = 0xffffffff
+
+
+class EmulatedSwitch (SwitchImpl):
+  """
+  SwitchImpl that, unless track_flows is set, keeps no flow table.
+
+  The stock switch keeps a linear flow table, parses every frame and logs
+  every message it handles; at thousands of flows that would dominate the
+  benchmark.  Without a table every frame misses, which is all the
+  benchmark needs, and frames are passed on as raw bytes.
+  """
+  def __init__ (self, dpid, name, ports, track_flows = False):
+    SwitchImpl.__init__(self, dpid, name = name, ports = ports,
+                        miss_send_len = of.OFP_DEFAULT_MISS_SEND_LEN)
+    self.track_flows = track_flows
+    self.output_raw = None  # f(switch, port_no, data), set by TopoEmulator
+    self.flow_mods = 0
+
+  def _receive_flow_mod (self, ofp):
+    self.flow_mods += 1
+    if self.track_flows:
+      self.table.process_flow_mod(ofp)
+    if ofp.buffer_id > 0 and ofp.buffer_id != NO_BUFFER:
+      self._process_actions_for_packet_from_buffer(ofp.actions, ofp.buffer_id)
+
+  def _receive_packet_out (self, packet_out):
+    actions = packet_out.actions
+    if (packet_out.data and not self.track_flows and
+        not [a for a in actions if a.type != of.OFPAT_OUTPUT or
+             a.port >= of.OFPP_MAX]):
+      for a in actions:
+        self.output_raw(self, a.port, packet_out.data)
+    elif packet_out.data:
+      self._process_actions_for_packet(actions, packet_out.data,
+                                       packet_out.in_port)
+    elif packet_out.buffer_id > 0:
+      self._process_actions_for_packet_from_buffer(actions,
+                                                   packet_out.buffer_id)
+
+  def inject (self, data, in_port):
+    "Handle a frame arriving from a host or a neighbor switch."
+    if self.track_flows:
+      self.process_packet(pkt.ethernet(data), in_port)
+    else:
+      self.send(of.ofp_packet_in(xid = self.xid_count.next(),
+                                 in_port = in_port, buffer_id = NO_BUFFER,
+                                 reason = of.OFPR_NO_MATCH, data = data))
+
+
+class _Pipe (object):
+  """
+  In-memory replacement for the TCP session between one switch and POX.
+
+  Towards POX it looks like the socket of_01.Connection expects, towards the
+  switch like the IOWorker SwitchImpl expects.  Bytes are not handed over
+  on send(); the emulator's run queue delivers them, so neither side
+  recurses into the other.
+  """
+  def __init__ (self, emu):
+    self.emu = emu
+    self.connection = None  # of_01.Connection, controller side
+    self.worker = _SwitchWorker(self)  # handed to the switch
+    self.to_controller = []
+    self.to_switch = ''
+    self.switch_offset = 0  # bytes of to_switch already consumed
+    self.receive_handler = None  # set by the switch's ControllerConnection
+
+  # Controller side: socket.
+  def send (self, data):
+    self.emu.count_sent(data)
+    self.to_switch = self.to_switch[self.switch_offset:] + data
+    self.switch_offset = 0
+    self.emu.schedule(self.deliver_to_switch)
+    return len(data)
+
+  def recv (self, bufsize):
+    data = ''.join(self.to_controller)
+    self.to_controller = []
+    return data
+
+  def fileno (self):
+    return -1
+
+  def shutdown (self, how):
+    pass
+
+  def close (self):
+    pass
+
+  def deliver_to_controller (self):
+    if self.to_controller:
+      start = time()
+      self.connection.read()
+      self.emu.controller_sec += time() - start
+
+  def deliver_to_switch (self):
+    if self.switch_offset < len(self.to_switch):
+      self.receive_handler(self.worker)
+
+
+class _SwitchWorker (object):
+  "Switch side of a _Pipe, with the IOWorker interface SwitchImpl expects."
+  def __init__ (self, pipe):
+    self.pipe = pipe
+
+  def set_receive_handler (self, handler):
+    self.pipe.receive_handler = handler
+
+  def peek_receive_buf (self):
+    # Only the next message, so that batches of thousands of messages are
+    # not copied once per message.
+    data = self.pipe.to_switch
+    offset = self.pipe.switch_offset
+    if len(data) - offset < 4:
+      return data[offset:]
+    return data[offset:offset + (ord(data[offset + 2]) << 8 |
+                                 ord(data[offset + 3]))]
+
+  def consume_receive_buf (self, l):
+    self.pipe.switch_offset += l
+
+  def send (self, data):
+    pipe = self.pipe
+    pipe.to_controller.append(data)
+    pipe.emu.schedule(pipe.deliver_to_controller)
+
+  def close (self):
+    pass
+
+
+class TopoEmulator (object):
+  """
+  One EmulatedSwitch per switch in a Topo, wired per Topo.port().
+
+  Work is run from a single FIFO queue: OpenFlow messages in either
+  direction and data-plane frames between switches.  Time spent inside the
+  controller's Connection.read() is accounted separately from the
+  emulator's own overhead.
+  """
+  def __init__ (self, t, track_flows = False):
+    self.t = t
+    self.queue = []
+    self.switches = {}  # [dpid] -> EmulatedSwitch
+    self.pipes = {}  # [dpid] -> _Pipe
+    self.hosts = set(t.hosts())
+    self.host_port = {}  # [host] -> (edge dpid, edge port)
+    self.sent = {}  # [ofp type] -> count, controller to switches
+    self.controller_sec = 0.0
+    self.on_host_rx = None  # f(host, data), called on delivery
+
+    for name in t.switches():
+      dpid = t.node_by_name(name).dpid
+      ports = []
+      for n in t.up_nodes(name) + t.down_nodes(name):
+        port = t.port(name, n)[0]
+        ports.append(of.ofp_phy_port(port_no = port,
+                                     hw_addr = EthAddr("%012x" %
+                                                       ((dpid << 8) + port))))
+        if n in self.hosts:
+          self.host_port[n] = (dpid, port)
+      sw = EmulatedSwitch(dpid, name, ports, track_flows)
+      sw.output_raw = self._output
+      sw.addListener(DpPacketOut, self._handle_DpPacketOut)
+      self.switches[dpid] = sw
+
+  def schedule (self, f, *args):
+    self.queue.append((f, args))
+
+  def run (self):
+    "Run queued work until there is none left."
+    queue = self.queue
+    i = 0
+    while i < len(queue):
+      f, args = queue[i]
+      f(*args)
+      i += 1
+    del queue[:]
+
+  def count_sent (self, data):
+    offset = 0
+    while len(data) - offset >= 4:
+      t = ord(data[offset + 1])
+      self.sent[t] = self.sent.get(t, 0) + 1
+      offset += ord(data[offset + 2]) << 8 | ord(data[offset + 3])
+
+  def connect (self):
+    "Open a connection from every switch and wait for the handshakes."
+    for dpid, sw in self.switches.iteritems():
+      pipe = _Pipe(self)
+      self.pipes[dpid] = pipe
+      sw.set_io_worker(pipe.worker)
+      # Connection.__init__ sends the first HELLO through the pipe.
+      pipe.connection = Connection(pipe)
+    self.run()
+    self.sent = {}
+    self.controller_sec = 0.0
+
+  def _handle_DpPacketOut (self, event):
+    self._output(event.node, event.port.port_no, event.packet.pack())
+
+  def _output (self, sw, port_no, data):
+    "Carry a frame sent out of a switch port to the node at the other end."
+    t = self.t
+    other = t.neighbor(sw.dpid, port_no)
+    if other is None:
+      return
+    if other in self.hosts:
+      if self.on_host_rx is not None:
+        self.on_host_rx(other, data)
+    else:
+      in_port = t.port(other, sw.name)[0]
+      self.schedule(self.switches[t.node_by_name(other).dpid].inject, data,
+                    in_port)
+
+  def send_from_host (self, host, data):
+    "Queue a frame sent by host into its edge switch."
+    dpid, port = self.host_port[host]
+    self.schedule(self.switches[dpid].inject, data, port)
+
+
+def host_packet (t, src, dst, i = 0, dst_mac = None):
+  "TCP SYN frame from host src to host dst, tagged with flow number i."
+  src_info = t.node_info[src]
+  dst_info = t.node_info[dst]
+  seg = pkt.tcp()
+  seg.srcport = FIRST_SPORT + i % SPORTS
+  seg.dstport = FIRST_DPORT + i / SPORTS
+  seg.off = 5
+  seg.flags = pkt.tcp.SYN_flag
+  ip = pkt.ipv4()
+  ip.protocol = pkt.ipv4.TCP_PROTOCOL
+  ip.srcip = IPAddr(src_info['ip'])
+  ip.dstip = IPAddr(dst_info['ip'])
+  ip.set_payload(seg)
+  eth = pkt.ethernet()
+  eth.type = pkt.ethernet.IP_TYPE
+  eth.src = EthAddr(src_info['mac'])
+  eth.dst = EthAddr(dst_mac or dst_info['mac'])
+  eth.set_payload(ip)
+  return eth.pack()
+
+
+def flow_number (data):
+  "Inverse of the port tagging in host_packet, or None if not a TCP frame."
+  if len(data) < 38 or data[12:14] != '\x08\x00' or ord(data[23]) != 6:
+    return None
+  off = 14 + (ord(data[14]) & 0xf) * 4
+  sport, dport = struct.unpack('!HH', data[off:off + 4])
+  return (sport - FIRST_SPORT) + (dport - FIRST_DPORT) * SPORTS
+
+
+def percentile (values, p):
+  "p-th percentile of a sorted list."
+  if not values:
+    return None
+  return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class FlowSetupBenchmark (object):
+  """
+  Replays synthetic flows through a TopoEmulator and measures their setup.
+
+  Flows are injected burst at a time; the next burst starts once the
+  controller and all switches have gone quiet.  Latency is from injection
+  to delivery at the destination host; with burst > 1 it includes queueing
+  behind the other flows of the burst.
+  """
+  def __init__ (self, emu, flows = 1000, burst = 1, seed = 0,
+                announce = True):
+    self.emu = emu
+    self.n_flows = flows
+    self.burst = burst
+    self.announce = announce
+    self.rand = random.Random(seed)
+    self.hosts = sorted(emu.hosts)
+    self.flows = []  # [i] -> (src, dst)
+    self.sent_at = []
+    self.latency = []  # [i] -> seconds, or None if never delivered
+    emu.on_host_rx = self._host_rx
+
+  def _host_rx (self, host, data):
+    i = flow_number(data)
+    if i is None or i >= len(self.flows) or self.flows[i][1] != host:
+      return
+    if self.latency[i] is None:
+      self.latency[i] = time() - self.sent_at[i]
+
+  def _announce (self):
+    """
+    Let the controller learn every host before measuring: the first host
+    broadcasts, then every other host sends to it.
+    """
+    t = self.emu.t
+    first = self.hosts[0]
+    self.emu.send_from_host(first, host_packet(t, first, self.hosts[1],
+                                               SPORTS - 1,
+                                               dst_mac = 'ff:ff:ff:ff:ff:ff'))
+    self.emu.run()
+    for h in self.hosts[1:]:
+      self.emu.send_from_host(h, host_packet(t, h, first, SPORTS - 1))
+      self.emu.run()
+
+  def run (self):
+    emu = self.emu
+    if self.announce:
+      self._announce()
+    emu.sent = {}
+    emu.controller_sec = 0.0
+
+    for i in xrange(self.n_flows):
+      src, dst = self.rand.sample(self.hosts, 2)
+      self.flows.append((src, dst))
+    packets = [host_packet(emu.t, src, dst, i)
+               for i, (src, dst) in enumerate(self.flows)]
+    self.sent_at = [None] * self.n_flows
+    self.latency = [None] * self.n_flows
+
+    start = time()
+    for first in xrange(0, self.n_flows, self.burst):
+      for i in xrange(first, min(first + self.burst, self.n_flows)):
+        self.sent_at[i] = time()
+        emu.send_from_host(self.flows[i][0], packets[i])
+      emu.run()
+    wall_sec = time() - start
+    return self.summary(wall_sec)
+
+  def summary (self, wall_sec):
+    emu = self.emu
+    done = sorted(l for l in self.latency if l is not None)
+    ms = lambda s: None if s is None else s * 1000.0
+    return {'switches': len(emu.switches),
+            'hosts': len(self.hosts),
+            'flows': self.n_flows,
+            'burst': self.burst,
+            'delivered': len(done),
+            'wall_sec': wall_sec,
+            'controller_sec': emu.controller_sec,
+            'flows_per_sec': len(done) / wall_sec if wall_sec else None,
+            'controller_flows_per_sec': (len(done) / emu.controller_sec
+                                         if emu.controller_sec else None),
+            'latency_ms': {'p50': ms(percentile(done, 50)),
+                           'p90': ms(percentile(done, 90)),
+                           'p99': ms(percentile(done, 99)),
+                           'max': ms(done[-1] if done else None)},
+            'packet_in': self.n_flows,
+            'flow_mod': emu.sent.get(of.OFPT_FLOW_MOD, 0),
+            'packet_out': emu.sent.get(of.OFPT_PACKET_OUT, 0)}
+
+
+def launch (flows = 1000, burst = 1, seed = 0, track_flows = False,
+            announce = True, out = None):
+  """
+  Benchmark the RipLController already launched on the command line.
+
+  Args:
+    flows: number of synthetic flows
+    burst: flows injected at once before waiting for the controller
+    seed: seed for picking flow endpoints
+    track_flows: keep a flow table in the switches (slow, for debugging)
+    announce: make the controller learn all hosts before measuring
+    out: also write the results to this JSON file
+  """
+  flows = int(flows)
+  burst = int(burst)
+  seed = int(seed)
+  track_flows = str(track_flows).lower() == 'true'
+  announce = str(announce).lower() == 'true'
+
+  def run_benchmark ():
+    controller = core.components.get('RipLController')
+    if controller is None:
+      log.error("riplpox.riplpox must be launched before riplpox.emulator")
+      core.quit()
+      return
+    t = controller.t
+    start = time()
+    emu = TopoEmulator(t, track_flows)
+    emu.connect()
+    log.warn("Emulating %i switches, %i connected in %0.2fs",
+             len(emu.switches), len(controller.switches), time() - start)
+    controller.stats.snapshot()
+    result = FlowSetupBenchmark(emu, flows, burst, seed, announce).run()
+    result['handlers'] = controller.stats.snapshot()['handlers']
+    log.warn("Flow setup: %s", json.dumps(result, sort_keys = True))
+    if out:
+      json.dump(result, open(out, 'w'), indent = 2, sort_keys = True)
+    core.quit()
+
+  core.addListenerByName("UpEvent", lambda event: core.callLater(run_benchmark))
@@ -0,0 +1,185 @@
+"""
+Instrumentation for RipL-POX: handler latency and per-switch message counts.
+
+Handler latencies go into LatencyHistogram objects, HDR-style log-linear
+histograms of fixed size: values up to SUB_BUCKETS microseconds are exact,
+larger ones are kept to within 1 / (SUB_BUCKETS / 2) of their value, up to
+MAX_US.  Recording is one bit_length and one array increment, so every
+packet-in can be timed.
+
+ControllerStats keeps one histogram per handler and packet_in, flow_mod and
+packet_out counts per switch.  snapshot() returns them as a dict, suitable
+for JSON, and starts a new interval.
+"""
+
+from array import array
+from functools import wraps
+from time import time
+import json
+
+from pox.lib.util import dpidToStr
+from pox.web.webcore import SplitRequestHandler
+
+# Sub-buckets per power of two: 2 ** PRECISION_BITS.
+PRECISION_BITS = 7
+SUB_BUCKETS = 1 << PRECISION_BITS
+HALF_BUCKETS = SUB_BUCKETS / 2
+# Largest value told apart, in microseconds (about 67 s); above it, clamped.
+MAX_US = (1 << 26) - 1
+
+# Messages counted per switch.
+COUNTERS = ('packet_in', 'flow_mod', 'packet_out')
+
+# Percentiles reported in snapshots.
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _index (us):
+  "Return the bucket index for a value in microseconds."
+  if us < SUB_BUCKETS:
+    return us
+  shift = us.bit_length() - PRECISION_BITS
+  return shift * HALF_BUCKETS + (us >> shift)
+
+
+def _upper (index):
+  "Return the largest value in microseconds that falls in a bucket."
+  if index < SUB_BUCKETS:
+    return index
+  shift = index / HALF_BUCKETS - 1
+  return ((index - shift * HALF_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram (object):
+  """
+  Fixed-memory histogram of durations.
+  """
+  def __init__ (self):
+    self.counts = array('L', [0] * (_index(MAX_US) + 1))
+    self.reset()
+
+  def reset (self):
+    for i in xrange(len(self.counts)):
+      self.counts[i] = 0
+    self.count = 0
+    self.total_us = 0
+    self.max_us = 0
+
+  def record (self, seconds):
+    "Record a duration given in seconds."
+    us = min(int(seconds * 1e6), MAX_US)
+    self.counts[_index(us)] += 1
+    self.count += 1
+    self.total_us += us
+    if us > self.max_us:
+      self.max_us = us
+
+  def percentile (self, p):
+    "Return the p-th percentile in microseconds, or None if empty."
+    if not self.count:
+      return None
+    rank = max(1, int(self.count * p / 100.0 + 0.5))
+    seen = 0
+    for i, n in enumerate(self.counts):
+      seen += n
+      if seen >= rank:
+        return min(_upper(i), self.max_us)
+    return self.max_us
+
+  def summary (self):
+    "Return count, mean, max and PERCENTILES, in milliseconds."
+    ret = {'count': self.count}
+    if self.count:
+      ret['mean_ms'] = self.total_us / 1000.0 / self.count
+      ret['max_ms'] = self.max_us / 1000.0
+      for p in PERCENTILES:
+        ret['p%s_ms' % p] = self.percentile(p) / 1000.0
+    return ret
+
+
+class ControllerStats (object):
+  """
+  Handler latency histograms and per-switch message counters.
+  """
+  def __init__ (self):
+    self.handlers = {}  # [handler name] -> LatencyHistogram
+    self.switches = {}  # [dpid] -> {counter name: count}
+    self.start = time()
+
+  def record (self, name, seconds):
+    h = self.handlers.get(name)
+    if h is None:
+      h = self.handlers[name] = LatencyHistogram()
+    h.record(seconds)
+
+  def count (self, dpid, name, n = 1):
+    counters = self.switches.get(dpid)
+    if counters is None:
+      counters = self.switches[dpid] = dict.fromkeys(COUNTERS, 0)
+    counters[name] += n
+
+  def snapshot (self):
+    """
+    Return the stats of the interval since the last snapshot, then reset
+    them.
+    """
+    now = time()
+    interval = now - self.start
+    totals = dict.fromkeys(COUNTERS, 0)
+    switches = {}
+    for dpid, counters in self.switches.iteritems():
+      switches[dpidToStr(dpid)] = dict(counters)
+      for name in COUNTERS:
+        totals[name] += counters[name]
+    ret = {'time': now,
+           'interval': interval,
+           'handlers': dict((name, h.summary())
+                            for name, h in self.handlers.iteritems()),
+           'totals': totals,
+           'packet_in_per_sec': totals['packet_in'] / interval
+                                if interval > 0 else 0.0,
+           'switches': switches}
+    for h in self.handlers.itervalues():
+      h.reset()
+    self.switches = {}
+    self.start = now
+    return ret
+
+
+def timed (name):
+  """
+  Decorator for event handlers of an object with a ControllerStats in
+  self.stats: records the time each call takes under name.
+  """
+  def decorate (f):
+    @wraps(f)
+    def wrapper (self, *args, **kw):
+      start = time()
+      try:
+        return f(self, *args, **kw)
+      finally:
+        self.stats.record(name, time() - start)
+    return wrapper
+  return decorate
+
+
+class StatsHandler (SplitRequestHandler):
+  """
+  Serves the latest snapshot, as JSON, from the POX web server.
+
+  args is a callable returning the snapshot.
+  """
+  def do_GET (self):
+    self.send_snapshot(True)
+
+  def do_HEAD (self):
+    self.send_snapshot(False)
+
+  def send_snapshot (self, isGet):
+    r = json.dumps(self.args(), sort_keys = True)
+    self.send_response(200)
+    self.send_header("Content-type", "application/json")
+    self.send_header("Content-Length", str(len(r)))
+    self.end_headers()
+    if isGet:
+      self.wfile.write(r)
@@ -0,0 +1,88 @@
+"""
+Bounded MAC learning table whose entries expire when not refreshed.
+
+Expiry is driven by a timer wheel: one slot per tick of the TTL, each
+holding the MACs that expire at that tick.  tick() drops only the MACs of
+one slot, and refreshing an entry moves it between two slots, so no
+operation scans the whole table.  When the table is full, learning a new
+MAC evicts the entry closest to expiry.
+"""
+
+from math import ceil
+
+# Seconds an entry lives without being refreshed.
+MAC_TTL = 300.0
+# Seconds per wheel slot; the TTL is rounded up to a whole number of ticks.
+MAC_TICK = 1.0
+# Largest number of entries held at once.
+MAC_CAPACITY = 65536
+
+
+class MacTable (object):
+  """
+  [mac] -> (dpid, port), with expiry and a capacity.
+
+  Call tick() every tick_sec seconds.
+  """
+  def __init__ (self, ttl = MAC_TTL, tick_sec = MAC_TICK,
+                capacity = MAC_CAPACITY):
+    self.ttl_ticks = max(1, int(ceil(ttl / tick_sec)))
+    self.tick_sec = tick_sec
+    self.capacity = capacity
+    self.entries = {}  # [mac] -> [dpid, port, expiry tick]
+    self.wheel = [set() for _ in xrange(self.ttl_ticks + 1)]
+    self.now = 0  # ticks so far
+    self.expired = 0
+    self.evicted = 0
+
+  def __len__ (self):
+    return len(self.entries)
+
+  def __contains__ (self, mac):
+    return mac in self.entries
+
+  def get (self, mac):
+    "Return (dpid, port) where mac was last seen, or None."
+    entry = self.entries.get(mac)
+    if entry is None:
+      return None
+    return entry[0], entry[1]
+
+  def learn (self, mac, dpid, port):
+    "Record that mac was seen on port of dpid, refreshing its TTL."
+    expiry = self.now + self.ttl_ticks
+    slot = expiry % len(self.wheel)
+    entry = self.entries.get(mac)
+    if entry is None:
+      if len(self.entries) >= self.capacity:
+        self._evict()
+      self.entries[mac] = [dpid, port, expiry]
+      self.wheel[slot].add(mac)
+      return
+    entry[0] = dpid
+    entry[1] = port
+    if entry[2] != expiry:
+      self.wheel[entry[2] % len(self.wheel)].discard(mac)
+      self.wheel[slot].add(mac)
+      entry[2] = expiry
+
+  def _evict (self):
+    "Drop the entry closest to expiry."
+    wheel = self.wheel
+    for i in xrange(1, len(wheel) + 1):
+      macs = wheel[(self.now + i) % len(wheel)]
+      if macs:
+        del self.entries[macs.pop()]
+        self.evicted += 1
+        return
+
+  def tick (self):
+    "Advance the wheel one slot and drop the entries expiring there."
+    self.now += 1
+    slot = self.now % len(self.wheel)
+    macs = self.wheel[slot]
+    if macs:
+      for mac in macs:
+        del self.entries[mac]
+      self.expired += len(macs)
+      self.wheel[slot] = set()
@@ -2,13 +2,22 @@
 RipL+POX.  As simple a data center controller as possible.
 """
 
+from time import time
+import json
+import struct
+
 from pox.core import core
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
 from pox.lib.util import dpidToStr
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import EventMixin
+from pox.lib.recoco import Timer
 
 from ripl.mn import topos
 
+from instrument import ControllerStats, StatsHandler, timed
+from mactable import MacTable, MAC_TTL, MAC_TICK, MAC_CAPACITY
 from util import buildTopo, getRouting
 
 log = core.getLogger()
@@ -16,6 +25,42 @@ log = core.getLogger()
 # Number of bytes to send for packet_ins
 MISS_SEND_LEN = 2000
 
+# Seconds an installed entry may sit unused before the switch removes it
+IDLE_TIMEOUT = 20
+
+# Offset of the xid in an OpenFlow header
+XID_START = 4
+
+# Bytes of an ofp_flow_mod before and after its ofp_match
+FLOW_MOD_MATCH_START = 8
+FLOW_MOD_MATCH_END = FLOW_MOD_MATCH_START + 40
+
+# Offsets in a packed ofp_match of nw_proto, and of nw_src through tp_dst
+MATCH_NW_PROTO = 25
+MATCH_NW_SRC = 28
+MATCH_TP_END = 40
+
+# Bytes of an ofp_packet_out before its actions, and its buffer_id for none
+PACKET_OUT_LEN = 16
+NO_BUFFER = 0xffffffff
+
+# Priority of the edge switch entries sending every ARP frame to us
+ARP_PRIORITY = of.OFP_DEFAULT_PRIORITY + 1
+ARP_ETHERTYPE = struct.pack("!H", pkt.ethernet.ARP_TYPE)
+ARP_REQUEST = struct.pack("!H", pkt.arp.REQUEST)
+
+# Seconds between port counter polls, for routing engines that use them
+STATS_INTERVAL = 1.0
+
+# Seconds between dumps of handler latencies and message counts
+DUMP_INTERVAL = 5.0
+
+# reactive: install a route per flow on packet-in.
+# proactive: also install a dl_dst entry per host on every switch once all
+# switches are up; needs a destination-based engine such as static.
+MODES = ('reactive', 'proactive')
+DEF_MODE = 'reactive'
+
 
 # Borrowed from pox/forwarding/l2_multi
 class Switch (EventMixin):
@@ -60,7 +105,7 @@ class Switch (EventMixin):
   def install(self, port, match, buf = -1):
     msg = of.ofp_flow_mod()
     msg.match = match
-    msg.idle_timeout = 20
+    msg.idle_timeout = IDLE_TIMEOUT
     msg.hard_timeout = 0
     msg.actions.append(of.ofp_action_output(port = port))
     msg.buffer_id = buf
@@ -73,38 +118,137 @@ class Switch (EventMixin):
 
 class RipLController(EventMixin):
 
-  def __init__ (self, t, r):
+  def __init__ (self, t, r, stats_interval = STATS_INTERVAL, mode = DEF_MODE,
+                arp_proxy = True, stats_file = None,
+                dump_interval = DUMP_INTERVAL, mac_ttl = MAC_TTL,
+                mac_capacity = MAC_CAPACITY):
     self.switches = {}  # Switches seen: [dpid] -> Switch
     self.t = t  # Master Topo object, passed in and never modified.
     self.r = r  # Master Routing object, passed in and reused.
-    self.macTable = {}  # [mac] -> (dpid, port)
+    # [mac] -> (dpid, port) of the host port it was last seen on
+    self.macTable = MacTable(mac_ttl, MAC_TICK, mac_capacity)
+    self.mac_timer = Timer(MAC_TICK, self.macTable.tick, recurring = True)
+    self.mode = mode
+    self.proactive_dpids = set()  # Switches sent the full proactive table
+    self.proactive_barriers = {}  # [xid] -> dpid, until the barrier reply
+    self.proactive_start = None
+    self.flow_templates = {}  # [(node, out_port)] -> (dpid, head, tail)
+    # [(ingress dpid, match)] -> [expiry time, xids of unanswered barriers]
+    self.pending_installs = {}
+    # [barrier xid] -> (dpid, (ingress dpid, match), flow_mod xid)
+    self.install_barriers = {}
+    # [flow_mod xid] -> (node, (ingress dpid, match)), until its barrier reply
+    self.install_flow_mods = {}
+    self.flood_actions = None  # [(dpid, {in_port: packed actions})]
+    # [raw ip] -> middle of the ARP reply from that host, or None to flood
+    self.arp_replies = self._arp_replies() if arp_proxy else None
 
     # TODO: generalize all_switches_up to a more general state machine.
     self.all_switches_up = False  # Sequences event handling.
     self.listenTo(core.openflow, priority=0)
 
+    # Poll port counters for routing engines that adapt to load.
+    self.stats_timer = None
+    if hasattr(r, 'update_port_stats'):
+      self.stats_timer = Timer(stats_interval, self._request_port_stats,
+                               recurring = True)
+
+    # Handler latencies and per-switch message counts, dumped every
+    # dump_interval seconds to stats_file, one JSON object per line, and
+    # served at /riplpox/stats if the POX web server is running.
+    self.stats = ControllerStats()
+    self.stats_file = open(stats_file, 'a') if stats_file else None
+    self.dump_interval = dump_interval
+    self.dump_timer = None
+    self.last_snapshot = {}
+    core.addListenerByName("UpEvent", self._start_dumps)
+
+  def _start_dumps(self, event):
+    web = core.hasComponent('WebServer')
+    if web:
+      core.WebServer.set_handler('/riplpox/stats', StatsHandler,
+                                 lambda: self.last_snapshot)
+    if web or self.stats_file:
+      self.dump_timer = Timer(self.dump_interval, self._dump_stats,
+                              recurring = True)
+
+  def _dump_stats(self):
+    self.last_snapshot = self.stats.snapshot()
+    if self.stats_file:
+      self.stats_file.write(json.dumps(self.last_snapshot, sort_keys = True))
+      self.stats_file.write('\n')
+      self.stats_file.flush()
+
   def _raw_dpids(self, arr):
     "Convert a list of name strings (from Topo object) to numbers."
     return [self.t.id_gen(name = a).dpid for a in arr]
 
+  def _flow_template(self, node, out_port):
+    """
+    Return (dpid, head, tail): a packed flow_mod forwarding out of out_port
+    on node, split around its match.
+
+    The xid in head is a placeholder; _install_path patches a fresh one into
+    every flow_mod it sends.
+    """
+    template = self.flow_templates.get((node, out_port))
+    if template is None:
+      msg = of.ofp_flow_mod(idle_timeout = IDLE_TIMEOUT, hard_timeout = 0,
+                            buffer_id = -1)
+      msg.actions.append(of.ofp_action_output(port = out_port))
+      data = msg.pack()
+      template = (self.t.id_gen(name = node).dpid,
+                  data[:FLOW_MOD_MATCH_START], data[FLOW_MOD_MATCH_END:])
+      self.flow_templates[(node, out_port)] = template
+    return template
+
   def _install_path(self, event, out_dpid, final_out_port, packet):
-    "Install entries on route between two switches."
+    """
+    Install entries on route between two switches.
+
+    The match is packed once and spliced into per-hop flow_mod templates,
+    each sent with its own xid and followed by a barrier.  Until every switch
+    on the route answers its barrier, or the entry would have idled out,
+    packet-ins for the same match at the same ingress switch install nothing.
+    """
+    match = of.ofp_match.from_packet(packet).pack()
+    now = time()
+    key = (event.dpid, match)
+    pending = self.pending_installs.get(key)
+    if pending is not None and pending[0] > now:
+      return
     in_name = self.t.id_gen(dpid = event.dpid).name_str()
     out_name = self.t.id_gen(dpid = out_dpid).name_str()
-    route = self.r.get_route(in_name, out_name, out_port=final_out_port)
-    log.info("route from src: %s to dst %s: %s" % (packet.src, packet.dst, route))
-    match = of.ofp_match.from_packet(packet)
+    five_tuple = (match[MATCH_NW_PROTO] +
+                  match[MATCH_NW_SRC:MATCH_TP_END])
+    route = self.r.get_route(in_name, out_name, out_port=final_out_port,
+                             five_tuple=five_tuple)
+    log.info("route from src: %s to dst %s: %s", packet.src, packet.dst, route)
+    port = self.t.port
+    last = len(route) - 1
+    barriers = set()
     for i, node in enumerate(route):
-      node_dpid = self.t.id_gen(name = node).dpid
-      if i < len(route) - 1:
-        next_node = route[i + 1]
-        out_port, next_in_port = self.t.port(node, next_node)
+      if i < last:
+        out_port = port(node, route[i + 1])[0]
       else:
         out_port = final_out_port
-      self.switches[node_dpid].install(out_port, match)
+      dpid, head, tail = self._flow_template(node, out_port)
+      xid = of.generateXID()
+      barrier_xid = of.generateXID()
+      self.switches[dpid].connection.send(
+          head[:XID_START] + struct.pack('!I', xid) + head[XID_START + 4:] +
+          match + tail + struct.pack('!BBHI', of.OFP_VERSION,
+                                     of.OFPT_BARRIER_REQUEST, 8, barrier_xid))
+      self.stats.count(dpid, 'flow_mod')
+      self.install_flow_mods[xid] = (node, key)
+      self.install_barriers[barrier_xid] = (dpid, key, xid)
+      barriers.add(barrier_xid)
+    self.pending_installs[key] = [now + IDLE_TIMEOUT, barriers]
 
+  @timed('PacketIn')
   def _handle_PacketIn(self, event):
     #log.info("Parsing PacketIn.")
+    self.stats.count(event.dpid, 'packet_in')
     if not self.all_switches_up:
       log.info("Saw PacketIn before all switches were up - ignoring.")
       return
@@ -115,16 +259,20 @@ class RipLController(EventMixin):
       in_port = event.port
       t = self.t
 
-      in_sw = self.t.id_gen(dpid=dpid)
-      # Learn MAC address of the sender on every packet-in for only EDGE switches.
-      if in_sw.pod != 4 and (in_sw.sw == 0 or in_sw.sw == 1) and (in_port == 2 or in_port == 4):
-        self.macTable[packet.src] = (dpid, in_port)
+      # Learn MAC address of the sender on every packet-in from a host port.
+      neighbor = t.neighbor(dpid, in_port)
+      if neighbor is not None and t.layer(neighbor) == t.LAYER_HOST:
+        self.macTable.learn(packet.src, dpid, in_port)
   
       #log.info("mactable: %s" % self.macTable)
+
+      if self.arp_replies is not None and self._proxy_arp(event):
+        return
   
       # Insert flow, deliver packet directly to destination.
-      if packet.dst in self.macTable:
-        out_dpid, out_port = self.macTable[packet.dst]
+      entry = self.macTable.get(packet.dst)
+      if entry is not None:
+        out_dpid, out_port = entry
         try:
           self._install_path(event, out_dpid, out_port, packet)
         except Exception as e:
@@ -133,30 +281,174 @@ class RipLController(EventMixin):
 
         #log.info("sending to entry in mactable: %s %s" % (out_dpid, out_port))
         self.switches[out_dpid].send_packet_data(out_port, event.data)
+        self.stats.count(out_dpid, 'packet_out')
 
       else:
         # Broadcast to every output port except the input on the input switch.
         # Hub behavior, baby!
-        for sw in self._raw_dpids(t.layer_nodes(t.LAYER_EDGE)):
-          #log.info("considering sw %s" % sw)
-          ports = []
-          sw_name = t.id_gen(dpid = sw).name_str()
-          for host in t.down_nodes(sw_name):
-            sw_port, host_port = t.port(sw_name, host)
-            if sw != dpid or (sw == dpid and in_port != sw_port):
-              ports.append(sw_port)
-          # Send packet out each non-input host port
-          # TODO: send one packet only.
-          for port in ports:
-            #log.info("sending to port %s on switch %s" % (port, sw))
-            #buffer_id = event.ofp.buffer_id
-            #if sw == dpid:
-            #  self.switches[sw].send_packet_bufid(port, event.ofp.buffer_id)
-            #else:
-            self.switches[sw].send_packet_data(port, event.data)
-            #  buffer_id = -1
+        self._flood(dpid, in_port, event.data)
+
+  def _flood_actions(self):
+    """
+    Return [(dpid, actions)] for every edge switch, where actions maps an
+    input port to the packed output actions for all host ports but that
+    one; key None holds all host ports.
+    """
+    t = self.t
+    ret = []
+    for sw_name in t.layer_nodes(t.LAYER_EDGE):
+      ports = [t.port(sw_name, host)[0] for host in t.down_nodes(sw_name)]
+      actions = {}
+      for in_port in [None] + ports:
+        actions[in_port] = b''.join(of.ofp_action_output(port = p).pack()
+                                    for p in ports if p != in_port)
+      ret.append((t.id_gen(name = sw_name).dpid, actions))
+    return ret
+
+  def _packet_out(self, actions, data):
+    "Return a packed packet_out sending data per the packed actions."
+    return b''.join((
+        struct.pack("!BBHL", of.OFP_VERSION, of.OFPT_PACKET_OUT,
+                    PACKET_OUT_LEN + len(actions) + len(data),
+                    of.generateXID()),
+        struct.pack("!LHH", NO_BUFFER, of.OFPP_NONE, len(actions)),
+        actions, data))
+
+  def _arp_replies(self):
+    """
+    Return {raw ip: frame} for every host in the topology, frame being the
+    ARP reply from that host with the requester's MAC, and its MAC and IP
+    as target, left out: bytes 6 to 32 of the complete reply.
+    """
+    t = self.t
+    ret = {}
+    for host in t.hosts():
+      node = t.id_gen(name = host)
+      mac = EthAddr(node.mac_str()).toRaw()
+      ip = IPAddr(node.ip_str()).toRaw()
+      ret[ip] = b''.join((mac, struct.pack("!HHHBBH", pkt.ethernet.ARP_TYPE,
+                                           pkt.arp.HW_TYPE_ETHERNET,
+                                           pkt.arp.PROTO_TYPE_IP, 6, 4,
+                                           pkt.arp.REPLY),
+                          mac, ip))
+    return ret
+
+  def _proxy_arp(self, event):
+    """
+    Answer an ARP request for a host in the topology out of the port it
+    came in on.  Return whether it was answered.
+    """
+    data = event.data
+    if (len(data) < 42 or data[12:14] != ARP_ETHERTYPE or
+        data[20:22] != ARP_REQUEST):
+      return False
+    reply = self.arp_replies.get(data[38:42])
+    if reply is None:
+      return False
+    # Destination MAC, the prebuilt middle, then the requester's MAC and IP.
+    action = of.ofp_action_output(port = event.port).pack()
+    self.switches[event.dpid].connection.send(
+        self._packet_out(action, data[6:12] + reply + data[22:32]))
+    self.stats.count(event.dpid, 'packet_out')
+    return True
+
+  def _flood(self, in_dpid, in_port, data):
+    """
+    Send a frame out of every host port except in_port on in_dpid, as one
+    packet_out, written at once, per edge switch.
+    """
+    if self.flood_actions is None:
+      self.flood_actions = self._flood_actions()
+    for dpid, actions in self.flood_actions:
+      if dpid == in_dpid:
+        packed = actions.get(in_port, actions[None])
+      else:
+        packed = actions[None]
+      sw = self.switches.get(dpid)
+      if not packed or sw is None or sw.connection is None:
+        continue
+      sw.connection.send(self._packet_out(packed, data))
+      self.stats.count(dpid, 'packet_out')
 
+  def _install_proactive(self):
+    """
+    Install a dl_dst entry for every host on every switch lacking them.
 
+    Each switch gets all its entries in one write, followed by a barrier.
+    """
+    t = self.t
+    rows = self.r.precompute()
+    matches = [(self.r.destination_id(h),
+                of.ofp_match(dl_dst = EthAddr(t.id_gen(name = h).mac_str())))
+               for h in t.hosts()]
+    packed = {}  # [(dst_id, port)] -> packed flow_mod, shared by switches
+    self.proactive_start = time()
+    for dpid, sw in self.switches.iteritems():
+      if dpid in self.proactive_dpids or sw.connection is None:
+        continue
+      row = rows[t.id_gen(dpid = dpid).name_str()]
+      batch = []
+      for dst_id, match in matches:
+        port = row[dst_id]
+        data = packed.get((dst_id, port))
+        if data is None:
+          msg = of.ofp_flow_mod(match = match)
+          msg.actions.append(of.ofp_action_output(port = port))
+          data = packed[(dst_id, port)] = msg.pack()
+        batch.append(data)
+      barrier = of.ofp_barrier_request()
+      batch.append(barrier.pack())
+      sw.connection.send(b''.join(batch))
+      self.stats.count(dpid, 'flow_mod', len(matches))
+      self.proactive_barriers[barrier.xid] = dpid
+      self.proactive_dpids.add(dpid)
+    log.info("Sent %i proactive entries to each of %i switches",
+             len(matches), len(self.proactive_barriers))
+
+  @timed('BarrierIn')
+  def _handle_BarrierIn(self, event):
+    install = self.install_barriers.pop(event.xid, None)
+    if install is not None:
+      _, key, flow_mod_xid = install
+      self.install_flow_mods.pop(flow_mod_xid, None)
+      pending = self.pending_installs.get(key)
+      if pending is not None:
+        pending[1].discard(event.xid)
+        if not pending[1]:
+          del self.pending_installs[key]
+      return
+    dpid = self.proactive_barriers.pop(event.xid, None)
+    if dpid is not None and not self.proactive_barriers:
+      log.info("Proactive entries installed in %0.3fs",
+               time() - self.proactive_start)
+
+  def _handle_ErrorIn(self, event):
+    install = self.install_flow_mods.pop(event.xid, None)
+    if install is None:
+      return
+    node, key = install
+    match = of.ofp_match()
+    match.unpack(key[1])
+    log.error("flow_mod %i on %s failed for the flow entering %s: %s",
+              event.xid, node, dpidToStr(key[0]), match)
+    # Let the next packet-in for this flow try again.
+    self.pending_installs.pop(key, None)
+
+  def _request_port_stats(self):
+    "Ask every connected switch for its port counters."
+    for sw in self.switches.itervalues():
+      if sw.connection is not None:
+        body = of.ofp_port_stats_request(port_no = of.OFPP_NONE)
+        sw.connection.send(of.ofp_stats_request(type = of.OFPST_PORT,
+                                                body = body))
+
+  @timed('PortStatsReceived')
+  def _handle_PortStatsReceived(self, event):
+    now = time()
+    for stats in event.stats:
+      self.r.update_port_stats(event.dpid, stats.port_no, stats.tx_bytes, now)
+
+  @timed('ConnectionUp')
   def _handle_ConnectionUp (self, event):
     sw = self.switches.get(event.dpid)
     sw_str = dpidToStr(event.dpid)
@@ -174,32 +466,74 @@ class RipLController(EventMixin):
       log.info("Odd - already saw switch %s come up" % sw_str)
       sw.connect(event.connection)
     sw.connection.send(of.ofp_set_config(miss_send_len=MISS_SEND_LEN))
+    if (self.arp_replies is not None and
+        self.t.layer(name_str) == self.t.LAYER_EDGE):
+      # Send us every ARP frame, even those matching a dl_dst entry.
+      msg = of.ofp_flow_mod(priority = ARP_PRIORITY,
+                            match = of.ofp_match(dl_type =
+                                                 pkt.ethernet.ARP_TYPE))
+      msg.actions.append(of.ofp_action_output(port = of.OFPP_CONTROLLER,
+                                              max_len = MISS_SEND_LEN))
+      sw.connection.send(msg)
+      self.stats.count(event.dpid, 'flow_mod')
 
     if len(self.switches) == len(self.t.switches()):
       log.info("Woo!  All switches up")
       self.all_switches_up = True
+      if self.mode == 'proactive':
+        self._install_proactive()
 
   def _handle_ConnectionDown(self, event):
     sw_str = dpidToStr(event.dpid)
     log.info("Disconnecting switch: %s, %s", event.dpid, sw_str)
     sw = self.switches.pop(event.dpid, None)
+    self.proactive_dpids.discard(event.dpid)
+    for xid, (dpid, key, flow_mod_xid) in self.install_barriers.items():
+      if dpid == event.dpid:
+        del self.install_barriers[xid]
+        self.install_flow_mods.pop(flow_mod_xid, None)
+        self.pending_installs.pop(key, None)
     if sw is None:
       log.info('No such switch: %s', sw_str)
     else:
       self.all_switches_up = False
     
 
-def launch(topo = None, routing = None):
+def launch(topo = None, routing = None, stats_interval = STATS_INTERVAL,
+           mode = DEF_MODE, arp_proxy = True, stats_file = None,
+           dump_interval = DUMP_INTERVAL, mac_ttl = MAC_TTL,
+           mac_capacity = MAC_CAPACITY):
   """
   Args in format toponame,arg1,arg2,...
+
+  stats_interval sets seconds between port counter polls, which are only
+  sent when the routing engine uses them (e.g. --routing=loadaware).
+  mode is reactive or proactive; proactive defaults to --routing=static.
+  arp_proxy answers ARP requests for topology hosts from the controller
+  instead of flooding them; --arp_proxy=False turns it off.
+  Every dump_interval seconds, handler latencies and per-switch message
+  counts are appended to stats_file, if given, and served at /riplpox/stats
+  if web.webcore is launched too.
+  Learned MAC addresses expire mac_ttl seconds after last being seen; at
+  most mac_capacity are kept.
   """
+  if mode not in MODES:
+    raise Exception("unknown mode %s not in %s" % (mode, MODES))
+  if mode == 'proactive' and routing is None:
+    routing = 'static'
   # Instantiate a topo object from the passed-in file.
   if not topo:
     raise Exception("please specify topo and args on cmd line")
   else:
     t = buildTopo(topo, topos)
     r = getRouting(routing, t)
+  if mode == 'proactive' and not hasattr(r, 'precompute'):
+    raise Exception("proactive mode needs a destination-based routing "
+                    "engine such as static, not %s" % routing)
 
-  core.registerNew(RipLController, t, r)
+  arp_proxy = str(arp_proxy).lower() != 'false'
+  core.registerNew(RipLController, t, r, float(stats_interval), mode,
+                   arp_proxy, stats_file, float(dump_interval),
+                   float(mac_ttl), int(mac_capacity))
 
   log.info("RipL-POX running with topo=%s." % topo)
@@ -4,6 +4,7 @@ from mininet.util import makeNumeric
 
 from ripl.routing import STStructuredRouting, RandomStructuredRouting
 from ripl.routing import HashedStructuredRouting, StaticShortestPathRouting
+from ripl.routing import LoadAwareStructuredRouting, ECMPStructuredRouting
 
 
 # TODO: this code is duplicated from mininet/bin/mn, except for TOPOS/topos.
@@ -35,7 +36,9 @@ ROUTING = {
     'st': STStructuredRouting,
     'random': RandomStructuredRouting,
     'hashed': HashedStructuredRouting,
-    'static': StaticShortestPathRouting
+    'ecmp5': ECMPStructuredRouting,
+    'static': StaticShortestPathRouting,
+    'loadaware': LoadAwareStructuredRouting
 }
 
 def getRouting( routing_type, topo ):
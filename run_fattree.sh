@@ -29,7 +29,7 @@ run_single_experiment() {
 	dir="$subdir/data_$i"
 	mn -c
 	python tcp_outcast.py --n1 $n1 --n2 $n2 --bw 100 -d $dir -t 20 \
-	    --ft=True --impatient=True
+	    --ft=True --impatient=True --index=$results_dir/index.jsonl
 	python generate_plots.py --tcpdump=$dir/tcp_dump.0_0_1-eth2.txt \
 	    -r "10.0.0.2:5001" --outcast_host "10.0.0.3" -o $subdir/result_500 \
 	    --bucket_size_ms=20 --end_time_ms=500 --start_time_ms=0
@@ -53,7 +53,8 @@ run_big_experiment() {
 	dir="$subdir/data_$i"
 	mn -c
 	python tcp_outcast.py --n1 $n1 --n2 $n2 --bw 100 -d $dir -t 60 \
-	    --ft=True --impatient=True --iperf=/home/ubuntu/iperf-patched/src/iperf
+	    --ft=True --impatient=True --iperf=/home/ubuntu/iperf-patched/src/iperf \
+	    --index=$results_dir/index.jsonl
 	python generate_plots.py --tcpdump=$dir/tcp_dump.0_0_1-eth2.txt \
 	    -r "10.0.0.2:5001" --outcast_host "10.0.0.3" -o $subdir/result_500 \
 	    --bucket_size_ms=20 --end_time_ms=5500 --start_time_ms=5000 \
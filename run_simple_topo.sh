@@ -43,7 +43,7 @@ run_once() {
     d=$3
     python tcp_outcast.py --n1 $n1 --n2 $n2 --bw $BW -t $T \
         -d $d --rto_min=$RTO_MIN --queue_size=$Q --iperf=$IPERF --hz=$HZ \
-        --impatient=true --use_tbf=true
+        --impatient=true --use_tbf=true --index=$results_dir/index.jsonl
     python join_tcpdump.py -f s0-eth1=$d/tcp_dump.s0-eth1.txt  \
         -f s0-eth3=$d/tcp_dump.s0-eth3.txt -f s0-eth2=$d/tcp_dump.s0-eth2.txt \
         -s s0-eth1=10.0.0.1 -s s0-eth2=10.0.0.2 -s s0-eth3=10.0.0.3 \
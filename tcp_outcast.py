@@ -14,12 +14,20 @@ from mininet.cli import CLI
 
 from time import sleep, time
 from multiprocessing import Process
+import multiprocessing
 from subprocess import Popen
 import termcolor as T
 import argparse
 
 import sys
 import os
+import json
+import socket
+
+from util.tc import tc_batch, qdisc_stats
+from util.capture import CaptureManager
+from util import manifest as run_manifest
+from util.watchdog import FidelityWatchdog
 
 def cprint(s, color, cr=True):
     """Print in color
@@ -70,6 +78,34 @@ parser.add_argument('--ft',
                     help="Whether to experiment on FatTreeTopology",
                     default=False)
 
+parser.add_argument('--k',
+                    type=int,
+                    help="Switch degree of the FatTreeTopology (4, 6, 8, ...).",
+                    default=4)
+
+parser.add_argument('--receiver',
+                    help="FatTreeTopology host receiving all flows.",
+                    default='0_0_2')
+
+parser.add_argument('--n_2hop_hosts',
+                    type=int,
+                    help="Number of FatTreeTopology hosts sharing the "
+                         "receiver's edge switch that send n1 flows each.",
+                    default=1)
+
+parser.add_argument('--host_cpu',
+                    type=float,
+                    help="Fraction of system CPU per host.  Defaults to 1 for "
+                         "the simple topology, and to a share of --cpu_budget "
+                         "for FatTreeTopology.",
+                    default=None)
+
+parser.add_argument('--cpu_budget',
+                    type=float,
+                    help="Fraction of system CPU split across all "
+                         "FatTreeTopology hosts.",
+                    default=0.8)
+
 parser.add_argument('--iperf',
                     dest="iperf",
                     help="Path to custom iperf",
@@ -82,9 +118,21 @@ parser.add_argument('--impatient',
 
 parser.add_argument('--hz',
                     type=int,
-                    help="HZ value for kernel timers.  5000 default determined "
-                         "experimentally for Mininet EC2",
-                    default=5000)
+                    help="HZ value for kernel timers.  If unset, use the value "
+                         "calibrated for this machine, or 5000 (determined "
+                         "experimentally for Mininet EC2).",
+                    default=None)
+
+parser.add_argument('--calibrate',
+                    help="Probe the tbf queue over a grid of burst values and "
+                         "cache the best HZ value for this machine.  Requires "
+                         "--use_tbf.",
+                    type=bool,
+                    default=False)
+
+parser.add_argument('--calibration_cache',
+                    help="File caching the calibrated HZ value per machine.",
+                    default=os.path.expanduser('~/.tcp_outcast_calibration.json'))
 
 parser.add_argument('--cli',
                     dest='cli',
@@ -98,13 +146,91 @@ parser.add_argument('--use_tbf',
                     type=bool,
                     default=False)
 
+parser.add_argument('--index',
+                    help="If set, append a summary of this run to this sweep "
+                         "index file (one JSON record per line).",
+                    default=None)
+
+parser.add_argument('--no_watchdog',
+                    dest='watchdog',
+                    action='store_false',
+                    help="Don't monitor host CPU throttling, qdisc counters "
+                         "and link rates during the run, nor tag unfaithful "
+                         "runs.")
+
+parser.add_argument('--watchdog_abort',
+                    type=bool,
+                    help="Stop the run early once the watchdog finds it "
+                         "unfaithful.",
+                    default=False)
+
+parser.add_argument('--max_throttled',
+                    type=float,
+                    help="Largest fraction of CPU periods a host may be "
+                         "throttled in before the run is unfaithful.",
+                    default=0.25)
+
+parser.add_argument('--max_rate_ratio',
+                    type=float,
+                    help="Largest ratio of achieved link rate to --bw before "
+                         "the run is unfaithful.",
+                    default=1.1)
+
+parser.add_argument('--min_rate_ratio',
+                    type=float,
+                    help="Smallest ratio of the receiver's bottleneck link "
+                         "rate to --bw, while flows run, before the run is "
+                         "unfaithful.  0 disables the check.",
+                    default=0.7)
+
+parser.add_argument('--max_overlimit_rate',
+                    type=float,
+                    help="Most qdisc overlimits per second, summed over switch "
+                         "interfaces, before the run is unfaithful.  0 "
+                         "disables the check.  Qdisc drops are recorded but "
+                         "not checked, as the experiment relies on them.",
+                    default=0)
+
+parser.add_argument('--capture_buffer_kb',
+                    type=int,
+                    help="Kernel ring buffer size for each tcpdump, in KiB.",
+                    default=524288)
+
+parser.add_argument('--capture_snaplen',
+                    type=int,
+                    help="Bytes of each packet kept by tcpdump.",
+                    default=128)
+
+parser.add_argument('--capture_rotate_mb',
+                    type=int,
+                    help="Rotate tcpdump segments after this many MB.",
+                    default=100)
+
+parser.add_argument('--capture_rotate_sec',
+                    type=int,
+                    help="If set, also rotate tcpdump segments after this "
+                         "many seconds.",
+                    default=0)
+
 
 # Expt parameters
 args = parser.parse_args()
+if args.calibrate and not args.use_tbf:
+  parser.error('--calibrate tunes the tbf queue; it requires --use_tbf')
 
 # Only import dctopo if we're going to use it.
 if args.ft:
   from ripl.ripl.dctopo import FatTreeTopo
+  assert args.k >= 4 and args.k % 2 == 0, 'k must be even and >= 4'
+  assert 1 <= args.n_2hop_hosts < args.k / 2, (
+      'a k=%d edge switch has only %d hosts' % (args.k, args.k / 2))
+
+# HZ values probed by --calibrate, largest first, i.e. smallest burst first.
+CALIBRATION_HZ_GRID = [20000, 10000, 5000, 2500, 1000, 500]
+# Achieved rate must fall within these fractions of --bw to be accepted.
+CALIBRATION_MIN_RATE = 0.93
+CALIBRATION_MAX_RATE = 1.03
+DEFAULT_HZ = 5000
 
 CUSTOM_IPERF_PATH = args.iperf
 assert(os.path.exists(CUSTOM_IPERF_PATH))
@@ -115,6 +241,45 @@ if not os.path.exists(args.dir):
 lg.setLogLevel('info')
 
 
+def calibration_key(bw_mbps):
+  """Key identifying this machine and link rate in the calibration cache."""
+  return '%s/%s/%smbit' % (socket.gethostname(), os.uname()[2], bw_mbps)
+
+
+def load_calibrated_hz(bw_mbps):
+  """Return the cached HZ value for this machine and rate, or None."""
+  try:
+    with open(args.calibration_cache) as fd:
+      cache = json.load(fd)
+  except (IOError, ValueError):
+    return None
+  entry = cache.get(calibration_key(bw_mbps))
+  return entry and entry['hz']
+
+
+def save_calibrated_hz(bw_mbps, hz, probes):
+  """Record the calibrated HZ value for this machine and rate.  The cache is
+  written to a temporary file and renamed over the old one, so an
+  interrupted run cannot leave it truncated."""
+  try:
+    with open(args.calibration_cache) as fd:
+      cache = json.load(fd)
+  except (IOError, ValueError):
+    cache = {}
+  cache[calibration_key(bw_mbps)] = {'hz': hz, 'burst_mbit': float(bw_mbps) / hz,
+                                     'time': time(), 'probes': probes}
+  tmp = '%s.%d.tmp' % (args.calibration_cache, os.getpid())
+  with open(tmp, 'w') as fd:
+    json.dump(cache, fd, indent=2, sort_keys=True)
+  os.rename(tmp, args.calibration_cache)
+
+
+if args.hz is None:
+  args.hz = load_calibrated_hz(args.bw) or DEFAULT_HZ
+
+manifest = run_manifest.RunManifest(args.dir, vars(args))
+
+
 class SimpleOutcastTopo(Topo):
   """Simple topology with two switches tailored to reproduce Outcast effect."""
 
@@ -158,37 +323,129 @@ def start_tcpprobe():
 def stop_tcpprobe():
     os.system("killall -9 cat; rmmod tcp_probe")
 
-def start_tcpdump(iface):
-    Popen("tcpdump -n -S -B 524288 -i %s > %s/tcp_dump.%s.txt" % (iface, args.dir, iface),
-          shell=True)
-
 # TODO(bhelsley): Ideally we should use a custom interface class, but my
 # attempts to do this hit some strange python voodoo.
-def configure_tbf_queue(iface, bw_mbps, queue_size_bytes):
-  # First, clear any existing config on the interface
-  cmds = ['tc qdisc del dev %s root' % iface]
-
+def tbf_queue_cmds(iface, bw_mbps, queue_size_bytes, hz=None):
+  """Return the tc batch lines that install a tbf root qdisc on iface."""
   # Documentation says divide bw by kernel HZ on host to get burst.  Very unclear what
   # the actual HZ value for our machines on EC2 are, so we tweak it by a flag.
   # The performance of the link is exceptionally sensitive to the burst value.  If burst is
   # too large, then there are frequent, unrealisitic bursts larger than the link rate,
   # if burst is too small, then throughput collapses.
-  burst = float(bw_mbps) / args.hz
+  burst = float(bw_mbps) / (hz or args.hz)
   # TODO(bhelsley): If we do not set peak rate and minburst, when tokens are available we
   # send as fast as possible.  This can cause large instantaneous bursts, but if our HZ
   # rate is set correctly experimentally the unwanted burstiness is minimal.
-  cmds.append(
-      'tc qdisc add dev %s root tbf rate %smbit '
-      'burst %smbit limit %s' % (iface, bw_mbps, burst, queue_size_bytes))
-  for cmd in cmds:
-    print cmd
-    print iface, os.system(cmd)
+  # replace swaps out whatever root qdisc the interface has, or adds one if
+  # there is none, so the command fails only if the tbf itself is rejected.
+  return ['qdisc replace dev %s root tbf rate %smbit '
+          'burst %smbit limit %s' % (iface, bw_mbps, burst, queue_size_bytes)]
+
+
+def netem_queue_cmds(iface, limit):
+  """Return the tc batch lines that resize the netem queue Mininet set up."""
+  return ['qdisc change dev %s parent 1:1 handle 10: netem limit %s' % (
+      iface, limit)]
+
+
+def configure_switch_queues(ifaces, hz=None):
+  """Configure the queue on every switch interface with a single tc process.
+
+  Returns the time in seconds taken to apply the config.  Raises an
+  exception, after recording the failure in the manifest, if tc fails or any
+  interface is left without its qdisc.
+  """
+  cmds = []
+  for iface in ifaces:
+    if args.use_tbf:
+      cmds.extend(tbf_queue_cmds(iface, args.bw, args.queue_size, hz))
+    else:
+      cmds.extend(netem_queue_cmds(iface, '20'))
+
+  ret, elapsed, out = tc_batch(cmds, '%s/tc_batch.txt' % args.dir)
+  print '  applied %d tc commands to %d interfaces in %.3f seconds' % (
+      len(cmds), len(ifaces), elapsed)
+
+  # Read back the applied config once to verify every interface got its qdisc.
+  kind = 'tbf' if args.use_tbf else 'netem'
+  qdiscs = qdisc_stats()
+  missing = [iface for iface in ifaces
+             if kind not in [q['kind'] for q in qdiscs.get(iface, [])]]
+  if ret != 0 or missing:
+    # Links without their qdisc are unshaped, so the run's data is invalid.
+    manifest.set('queue_config_error', {'tc_exit': ret, 'tc_output': out,
+                                        'kind': kind, 'missing': missing})
+    raise Exception('queue config failed: tc -batch exited with %d, no %s '
+                    'qdisc on %d of %d interfaces (see %s/tc_batch.txt):\n%s'
+                    % (ret, kind, len(missing), len(ifaces), args.dir, out))
+  print '  verified %s qdisc on all %d interfaces' % (kind, len(ifaces))
+  return elapsed
+
+
+def probe_rate(client, server, udp=False, seconds=2, port=5002):
+  """Measure the rate in Mbps from client to server with a short iperf run.
+
+  For UDP, the client offers more than --bw and the rate is the one reported
+  back by the server, so a too-large burst shows up as overshoot.
+  """
+  server_cmd = '%s -s -p %d%s' % (CUSTOM_IPERF_PATH, port, ' -u' if udp else '')
+  server.cmd('%s > /dev/null 2>&1 &' % server_cmd)
+  if udp:
+    # telnet cannot tell whether a UDP server is up.
+    sleep(.5)
+  else:
+    waitListening(client, server, port)
+  opts = ' -u -b %dM' % int(args.bw * 1.2) if udp else ''
+  out = client.cmd('%s -c %s -p %d -t %d -yc%s' % (
+      CUSTOM_IPERF_PATH, server.IP(), port, seconds, opts))
+  server.cmd('pkill -f "%s"' % server_cmd)
+  # With -yc the last line is the (server-side for UDP) report, and the
+  # 9th field is bits/sec.
+  lines = [l for l in out.strip().split('\n') if l.count(',') >= 8]
+  if not lines:
+    return None
+  return float(lines[-1].split(',')[8]) / 1e6
+
+
+def calibrate_tbf(net, ifaces, max_pairs=3):
+  """Pick the smallest tbf burst that achieves --bw without overshoot.
+
+  Every burst in the grid is applied to all switch interfaces, then a TCP
+  and a UDP probe run across a few host pairs.  The result is cached per
+  machine so later runs start with the right --hz value.
+
+  Returns the chosen HZ value, or None if no burst value was acceptable.
+  """
+  hosts = net.hosts
+  pairs = [(hosts[i], hosts[-1 - i]) for i in xrange(min(max_pairs, len(hosts) / 2))]
+  lo = CALIBRATION_MIN_RATE * args.bw
+  hi = CALIBRATION_MAX_RATE * args.bw
+  probes = []
+  for hz in CALIBRATION_HZ_GRID:
+    configure_switch_queues(ifaces, hz)
+    ok = True
+    for client, server in pairs:
+      tcp_mbps = probe_rate(client, server)
+      udp_mbps = probe_rate(client, server, udp=True)
+      probes.append({'hz': hz, 'client': str(client), 'server': str(server),
+                     'tcp_mbps': tcp_mbps, 'udp_mbps': udp_mbps})
+      print '  hz=%d burst=%.4fmbit %s->%s tcp=%s udp=%s' % (
+          hz, float(args.bw) / hz, client, server, tcp_mbps, udp_mbps)
+      if tcp_mbps is None or udp_mbps is None or tcp_mbps < lo or udp_mbps > hi:
+        ok = False
+        break
+    if ok:
+      save_calibrated_hz(args.bw, hz, probes)
+      return hz
+  return None
 
 
 def run_outcast(net, receiver, hosts_2hop, hosts_6hop, n_2hops, n_6hops,
                 tcpdump_ifaces, rto_min, queue_size, bw):
     """Run outcast experiment.
 
+    Returns a dict of tcpdump capture stats per interface.
+
     Args:
       receiver: the receiver node.
       hosts_2hop: a list of host node objects for host nodes
@@ -206,6 +463,15 @@ def run_outcast(net, receiver, hosts_2hop, hosts_6hop, n_2hops, n_6hops,
 
     seconds = args.time
 
+    manifest.set('receiver', {'host': str(receiver), 'ip': receiver.IP(),
+                              'port': 5001,
+                              'file': 'iperf_server.txt',
+                              'capture': 'tcp_dump.%s.txt' % tcpdump_ifaces[0]})
+    for hosts, n, hops in ((hosts_2hop, n_2hops, 2), (hosts_6hop, n_6hops, 6)):
+        for host in hosts:
+            manifest.add_flows(str(host), host.IP(), hops, n,
+                               ['iperf_%s.%d.txt' % (host, i) for i in xrange(n)])
+
     print 'Setting minRTO to %s on each host...' % rto_min
     cmd = 'ip route replace dev %%s-eth0 rto_min %s' % rto_min
     # for receiver.
@@ -219,7 +485,7 @@ def run_outcast(net, receiver, hosts_2hop, hosts_6hop, n_2hops, n_6hops,
 
     # Start the receiver
     port = 5001
-    receiver.cmd('%s -s -p' % CUSTOM_IPERF_PATH, port,
+    receiver.cmd('%s -s -p' % CUSTOM_IPERF_PATH, port, '-i 1 -yc',
                  '> %s/iperf_server.txt' % args.dir, '&')
 
     # Wait till the receiver server comes up by picking any 2 hop
@@ -228,14 +494,20 @@ def run_outcast(net, receiver, hosts_2hop, hosts_6hop, n_2hops, n_6hops,
 
     # Start TCP Probe to monitor CWND, and TCP Dump on the key interfaces.
     start_tcpprobe()
+    manifest.set('tcp_probe', 'tcp_probe.txt')
 
+    capture = CaptureManager(args.dir, buffer_kb=args.capture_buffer_kb,
+                             snaplen=args.capture_snaplen,
+                             rotate_mb=args.capture_rotate_mb,
+                             rotate_sec=args.capture_rotate_sec)
     for iface in tcpdump_ifaces:
-      start_tcpdump(iface)
+      capture.start(iface)
 
     # Wait for tcpdump to start
     sleep(5)
 
     print 'Starting flows...'
+    flows_start = time()
 
     # Start flows from 2 hop hosts.
     for host in hosts_2hop:
@@ -251,16 +523,62 @@ def run_outcast(net, receiver, hosts_2hop, hosts_6hop, n_2hops, n_6hops,
                     CUSTOM_IPERF_PATH, receiver.IP(), 5001, seconds,
                     args.dir, str(host), i))
 
+    watchdog = None
+    if args.watchdog:
+        hosts = [str(h) for h in [receiver] + hosts_2hop + hosts_6hop]
+        ifaces = [intf for s in net.switches for intf in s.intfNames()
+                  if intf != 'lo']
+        watchdog = FidelityWatchdog(hosts, ifaces, bw,
+                                    '%s/fidelity.txt' % args.dir,
+                                    bottleneck=tcpdump_ifaces[0],
+                                    flow_sec=seconds,
+                                    max_throttled=args.max_throttled,
+                                    max_rate_ratio=args.max_rate_ratio,
+                                    min_rate_ratio=args.min_rate_ratio,
+                                    max_overlimit_rate=args.max_overlimit_rate,
+                                    abort=args.watchdog_abort)
+        watchdog.start()
+
     # TODO(bhelsley): intelligent wait to detect when client iperf processes
     # have exited.
-    sleep(seconds + 5)
+    if watchdog:
+        if watchdog.aborted.wait(seconds + 5):
+            cprint('*** Aborting run: emulation fidelity below thresholds', 'red')
+        watchdog.stop()
+        manifest.set('fidelity', watchdog.summary())
+        if not watchdog.faithful():
+            cprint('*** Run is UNFAITHFUL: %s' % (
+                '; '.join(watchdog.violations[0]['reasons'])), 'red')
+    else:
+        sleep(seconds + 5)
 
     print 'Ending flows...'
     receiver.cmd('pkill iperf')
+    if watchdog and watchdog.aborted.is_set():
+        # Clients are still running when the watchdog cut the run short.
+        for host in hosts_2hop + hosts_6hop:
+            host.cmd('pkill iperf')
+    manifest.add_phase('flows', flows_start)
 
     # Shut down monitors
     stop_tcpprobe()
 
+    with manifest.phase('capture_stop'):
+      capture_stats = capture.stop()
+    for iface, stats in capture_stats.iteritems():
+      stats['file'] = 'tcp_dump.%s.txt' % iface
+    manifest.set('captures', capture_stats)
+    for iface, stats in sorted(capture_stats.iteritems()):
+      if stats['valid']:
+        print '  tcpdump %s: %s packets captured, %s dropped by kernel' % (
+            iface, stats['captured'], stats['dropped_kernel'])
+      else:
+        cprint('*** Capture on %s is INVALID: %s captured, %s dropped by '
+               'kernel, %s dropped by interface' % (
+                   iface, stats['captured'], stats['dropped_kernel'],
+                   stats['dropped_iface']), 'red')
+    return capture_stats
+
 def check_prereqs():
     "Check for necessary programs"
     prereqs = ['telnet', 'bwm-ng', 'iperf', 'ping']
@@ -309,42 +627,77 @@ def run_single_switch_outcast(net):
     bullies = [net.getNodeByName('h%d' % (i+2)) for i in xrange(n)]
 
     # TODO(bhelsley): Should move to: n1, n2, flows_per_host.
-    run_outcast(net, recvr, [h1], bullies, n_2hops=args.n1, n_6hops=args.n1,
-                tcpdump_ifaces=['s0-eth1', 's0-eth2', 's0-eth3'],
-                rto_min=args.rto_min,
-                queue_size=args.queue_size,
-                bw=args.bw)
-
-
-def fat_tree_get_6hop_nodes(net, topo, host_name):
-    """Returns all 6 hop nodes from host."""
-    host_pod = topo.id_gen(name=host_name).pod
-
-    hosts_6hop = []
-    for node in topo.layer_nodes(FatTreeTopo.LAYER_HOST):
-        node_pod = topo.id_gen(name=node).pod
-        if host_pod != node_pod:
-            hosts_6hop.append(net.getNodeByName(node))
-
-    return hosts_6hop
+    return run_outcast(net, recvr, [h1], bullies, n_2hops=args.n1,
+                       n_6hops=args.n1,
+                       tcpdump_ifaces=['s0-eth1', 's0-eth2', 's0-eth3'],
+                       rto_min=args.rto_min,
+                       queue_size=args.queue_size,
+                       bw=args.bw)
+
+
+def fat_tree_hop_count(topo, src, dst):
+    """Returns the number of links on a shortest path between two hosts."""
+    src_id = topo.id_gen(name=src)
+    dst_id = topo.id_gen(name=dst)
+    if src_id.pod != dst_id.pod:
+        return 6
+    if src_id.sw != dst_id.sw:
+        return 4
+    return 2
+
+
+def fat_tree_hosts_by_hops(topo, host_name):
+    """Returns {hop count: [host names sorted by dpid]} for all other hosts."""
+    ret = {}
+    hosts = sorted(topo.layer_nodes(FatTreeTopo.LAYER_HOST),
+                   key=lambda n: topo.id_gen(name=n).dpid)
+    for node in hosts:
+        if node != host_name:
+            ret.setdefault(fat_tree_hop_count(topo, host_name, node),
+                           []).append(node)
+    return ret
+
+
+def fat_tree_receiver_iface(topo, host_name):
+    """Returns the edge switch interface facing host_name."""
+    edge = topo.up_nodes(host_name)[0]
+    edge_port, _ = topo.port(edge, host_name)
+    return '%s-eth%d' % (edge, edge_port)
 
 
 def run_fat_tree_outcast(net):
-    recvr = net.getNodeByName('0_0_2')
-    hosts_2hop = [net.getNodeByName('0_0_3')]
-    hosts_6hop = fat_tree_get_6hop_nodes(net, net.topo, '0_0_2')
+    topo = net.topo
+    by_hops = fat_tree_hosts_by_hops(topo, args.receiver)
+    recvr = net.getNodeByName(args.receiver)
+    hosts_2hop = [net.getNodeByName(n)
+                  for n in by_hops[2][:args.n_2hop_hosts]]
+    hosts_6hop = [net.getNodeByName(n) for n in by_hops[6]]
     if args.n2 < len(hosts_6hop):
         n_6hops = 1
         hosts_6hop = hosts_6hop[:args.n2]
     else:
         n_6hops = int(args.n2 / len(hosts_6hop))
 
-    run_outcast(net, recvr, hosts_2hop, hosts_6hop, n_2hops=args.n1,
-                n_6hops=n_6hops,
-                tcpdump_ifaces=['0_0_1-eth2'],
-                rto_min=args.rto_min,
-                queue_size=args.queue_size,
-                bw=args.bw)
+    print 'k=%d: receiver %s, %d 2-hop hosts x %d flows, %d 6-hop hosts x %d flows' % (
+        topo.k, recvr, len(hosts_2hop), args.n1, len(hosts_6hop), n_6hops)
+    return run_outcast(net, recvr, hosts_2hop, hosts_6hop, n_2hops=args.n1,
+                       n_6hops=n_6hops,
+                       tcpdump_ifaces=[fat_tree_receiver_iface(topo, args.receiver)],
+                       rto_min=args.rto_min,
+                       queue_size=args.queue_size,
+                       bw=args.bw)
+
+
+def host_cpu_fraction(num_hosts):
+    """Fraction of total system CPU given to each host.
+
+    Mininet hosts share one machine, so as k grows each host's share shrinks:
+    split --cpu_budget evenly across hosts, but never give a host more than
+    one core.
+    """
+    if args.host_cpu:
+        return args.host_cpu
+    return min(1.0 / multiprocessing.cpu_count(), args.cpu_budget / num_hosts)
 
 
 def main():
@@ -352,29 +705,53 @@ def main():
     start = time()
 
     if args.ft:
-        topo = FatTreeTopo(4)
+        topo = FatTreeTopo(args.k)
+        manifest.set('topology', {'name': 'ft', 'k': args.k})
+        cpu = host_cpu_fraction(len(topo.hosts()))
+        print '*** k=%d fat tree: %d hosts, %d switches, %.4f of %d CPUs per host' % (
+            args.k, len(topo.hosts()), len(topo.switches()), cpu,
+            multiprocessing.cpu_count())
     else:
         n = args.n2 / args.n1
         topo = SimpleOutcastTopo(n=n)
+        manifest.set('topology', {'name': 'simple', 'n': n})
+        cpu = args.host_cpu or 1
+    manifest.data['topology'].update({
+        'hosts': len(topo.hosts()), 'switches': len(topo.switches()),
+        'links': len(topo.links()), 'host_cpu': cpu})
 
-    host = custom(CPULimitedHost, cpu=1)
+    host = custom(CPULimitedHost, cpu=cpu)
     link = custom(TCLink, bw=args.bw, delay='0ms', max_queue_size=200)
 
-    net = Mininet(topo=topo, host=host, link=link)
-
-    net.start()
+    with manifest.phase('net_start'):
+        net = Mininet(topo=topo, host=host, link=link)
+        net.start()
 
     print 'Setting queue size to %s for all switches...' % args.queue_size
-    for s in net.switches:
-      for intf in s.intfNames():
-        if intf == 'lo':
-            continue
-        if args.use_tbf:
-          configure_tbf_queue(intf, args.bw, args.queue_size)
-        else:
-          cmd = ("tc qdisc change dev %s parent 1:1 "
-                 "handle 10: netem limit %s" % (intf, '20'))
-          print '  %s' % intf, os.system(cmd)
+    ifaces = [intf for s in net.switches for intf in s.intfNames()
+              if intf != 'lo']
+    queue_start = time()
+    try:
+        if args.calibrate:
+            cprint("*** Calibrating tbf burst", "blue")
+            hz = calibrate_tbf(net, ifaces)
+            if hz is None:
+                cprint("*** No burst value in the grid reached %sMbps without "
+                       "overshoot; keeping hz=%d" % (args.bw, args.hz), "red")
+            else:
+                cprint("*** Calibrated hz=%d (burst %.4fmbit), cached in %s" % (
+                    hz, float(args.bw) / hz, args.calibration_cache), "green")
+                args.hz = hz
+                manifest.data['args']['hz'] = hz
+        configure_switch_queues(ifaces)
+    except Exception:
+        # Don't run on unshaped links; leave a manifest saying why.
+        cprint("*** Queue config failed; stopping", "red")
+        net.stop()
+        print 'Wrote %s' % manifest.write()
+        raise
+    manifest.add_phase('queue_config', queue_start)
+    manifest.data['topology']['hz'] = args.hz
 
     cprint("*** Dumping network connections:", "green")
     dumpNetConnections(net)
@@ -384,12 +761,14 @@ def main():
     if args.cli:
         CLI(net)
 
-    net.pingAll()
+    with manifest.phase('ping_all'):
+        net.pingAll()
 
     cprint("*** Testing bandwidth", "blue")
     if not args.impatient:
-      for pair, result in check_bandwidth(net, test_rate=('%sM' % args.bw)).iteritems():
-        print pair, '=', result
+      with manifest.phase('check_bandwidth'):
+        for pair, result in check_bandwidth(net, test_rate=('%sM' % args.bw)).iteritems():
+          print pair, '=', result
     else:
       print '  skipped'
 
@@ -399,10 +778,15 @@ def main():
     else:
         run_single_switch_outcast(net)
 
-    net.stop()
+    with manifest.phase('net_stop'):
+        net.stop()
     end = time()
     cprint("Experiment took %.3f seconds" % (end - start), "yellow")
 
+    print 'Wrote %s' % manifest.write()
+    if args.index:
+        run_manifest.append_index(args.index, manifest.summary())
+
 if __name__ == '__main__':
     check_prereqs()
     main()
@@ -0,0 +1,177 @@
+from subprocess import Popen, PIPE
+from threading import Thread, Event
+import glob
+import gzip
+import json
+import os
+import re
+import shutil
+import signal
+
+# Summary tcpdump prints to stderr when it exits, e.g.
+#   1234 packets captured
+#   1300 packets received by filter
+#   66 packets dropped by kernel
+#   0 packets dropped by interface
+pat_stats = re.compile(r'^(\d+) packets? (captured|received by filter|'
+                       r'dropped by kernel|dropped by interface)', re.M)
+STATS_KEYS = {'captured': 'captured',
+              'received by filter': 'received',
+              'dropped by kernel': 'dropped_kernel',
+              'dropped by interface': 'dropped_iface'}
+
+
+def stats_path(text_fname):
+    """Path of the stats sidecar written next to a tcpdump text file."""
+    return re.sub(r'\.txt$', '', text_fname) + '.stats'
+
+
+def load_stats(text_fname):
+    """Return the capture stats for a tcpdump text file, or None if the file
+       was not written by CaptureManager."""
+    try:
+        return json.load(open(stats_path(text_fname)))
+    except (IOError, ValueError):
+        return None
+
+
+def segment_key(fname):
+    """Sort key putting rotated segments in capture order.  tcpdump -C names
+       segments foo.pcap, foo.pcap1, foo.pcap2, ...; with -G the name also
+       carries the start time."""
+    m = re.match(r'(.*pcap)(\d*)(\.gz)?$', fname)
+    return (m.group(1), int(m.group(2) or 0))
+
+
+class Capture(object):
+    "One tcpdump process writing rotated pcap segments for one interface."
+
+    def __init__(self, iface, outdir):
+        self.iface = iface
+        self.prefix = '%s/tcp_dump.%s' % (outdir, iface)
+        self.text = self.prefix + '.txt'
+        self.log = self.prefix + '.log'
+        self.proc = None
+
+    def segments(self):
+        """Return pcap segments (compressed or not), oldest first."""
+        files = glob.glob(self.prefix + '.*pcap*')
+        return sorted(files, key=segment_key)
+
+    def open_segments(self):
+        """Return uncompressed segments tcpdump has closed."""
+        segs = [f for f in self.segments() if not f.endswith('.gz')]
+        if self.proc is not None and self.proc.poll() is None:
+            # The newest segment is still being written.
+            segs = segs[:-1]
+        return segs
+
+    def stats(self):
+        """Parse the summary tcpdump printed on exit."""
+        ret = dict((v, None) for v in STATS_KEYS.itervalues())
+        for n, key in pat_stats.findall(open(self.log).read()):
+            ret[STATS_KEYS[key]] = int(n)
+        ret['segments'] = [os.path.basename(f) for f in self.segments()]
+        drops = [ret['dropped_kernel'], ret['dropped_iface']]
+        # Missing counters mean tcpdump died before it could report them, so
+        # the capture cannot be trusted either.
+        ret['valid'] = (ret['captured'] is not None and
+                        not [d for d in drops if d])
+        return ret
+
+
+class CaptureManager(object):
+    """Runs tcpdump on a set of interfaces without competing with the links
+       for disk bandwidth.
+
+       Packets go through the kernel ring buffer (-B) into pcap segments of
+       bounded size (-C) or duration (-G); only headers are kept (-s).  A
+       background thread gzips each segment as soon as tcpdump closes it.
+       On stop(), kernel drop counts are collected, and the text output
+       expected by generate_plots.py is rendered from the segments together
+       with a stats sidecar that marks captures with drops as invalid."""
+
+    def __init__(self, outdir, buffer_kb=524288, snaplen=128, rotate_mb=100,
+                 rotate_sec=0, compress=True, poll_sec=1.0):
+        self.outdir = outdir
+        self.buffer_kb = buffer_kb
+        self.snaplen = snaplen
+        self.rotate_mb = rotate_mb
+        self.rotate_sec = rotate_sec
+        self.compress = compress
+        self.poll_sec = poll_sec
+        self.captures = {}
+        self._done = Event()
+        self._worker = None
+
+    def start(self, iface):
+        "Start capturing on iface."
+        cap = Capture(iface, self.outdir)
+        cmd = ['tcpdump', '-n', '-S', '-B', str(self.buffer_kb),
+               '-s', str(self.snaplen), '-i', iface, '-Z', 'root']
+        if self.rotate_sec:
+            cmd += ['-G', str(self.rotate_sec),
+                    '-w', cap.prefix + '.%Y%m%d-%H%M%S.pcap']
+        else:
+            cmd += ['-w', cap.prefix + '.pcap']
+        if self.rotate_mb:
+            cmd += ['-C', str(self.rotate_mb)]
+        cap.proc = Popen(cmd, stderr=open(cap.log, 'w'))
+        self.captures[iface] = cap
+        if self.compress and self._worker is None:
+            self._worker = Thread(target=self._compress_loop)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _compress_loop(self):
+        while not self._done.is_set():
+            self._compress_closed()
+            self._done.wait(self.poll_sec)
+
+    def _compress_closed(self):
+        for cap in self.captures.values():
+            for fname in cap.open_segments():
+                src = open(fname, 'rb')
+                dst = gzip.open(fname + '.gz', 'wb', 1)
+                shutil.copyfileobj(src, dst)
+                dst.close()
+                src.close()
+                os.remove(fname)
+
+    def _write_text(self, cap):
+        out = open(cap.text, 'w')
+        for fname in cap.segments():
+            if fname.endswith('.gz'):
+                unzip = Popen(['gzip', '-dc', fname], stdout=PIPE)
+                Popen(['tcpdump', '-n', '-S', '-r', '-'], stdin=unzip.stdout,
+                      stdout=out, stderr=PIPE).communicate()
+                unzip.wait()
+            else:
+                Popen(['tcpdump', '-n', '-S', '-r', fname], stdout=out,
+                      stderr=PIPE).communicate()
+        out.close()
+
+    def stop(self, write_text=True):
+        """Stop all captures and return {iface: stats dict}."""
+        for cap in self.captures.values():
+            if cap.proc.poll() is None:
+                # SIGINT makes tcpdump print its drop counters before exiting.
+                cap.proc.send_signal(signal.SIGINT)
+        for cap in self.captures.values():
+            cap.proc.wait()
+
+        self._done.set()
+        if self._worker is not None:
+            self._worker.join()
+        if self.compress:
+            self._compress_closed()
+
+        ret = {}
+        for iface, cap in self.captures.iteritems():
+            stats = cap.stats()
+            if write_text:
+                self._write_text(cap)
+            json.dump(stats, open(stats_path(cap.text), 'w'), indent=2,
+                      sort_keys=True)
+            ret[iface] = stats
+        return ret
@@ -0,0 +1,144 @@
+"""Machine-readable description of one experiment run.
+
+Each run directory gets a manifest.json recording the arguments, topology,
+flows, phase timings, capture stats and an inventory of the files written,
+so analysis tools can locate data without relying on naming conventions.
+A sweep index (one JSON line per run) allows querying many runs without
+scanning their directories:
+
+  python -m util.manifest results/index.jsonl n1=1 k=4
+"""
+
+from time import time
+from contextlib import contextmanager
+import json
+import os
+import socket
+import sys
+
+MANIFEST_NAME = 'manifest.json'
+VERSION = 1
+
+
+class RunManifest(object):
+    "Collects metadata during a run and writes it to <outdir>/manifest.json."
+
+    def __init__(self, outdir, args):
+        self.outdir = outdir
+        self.data = {'version': VERSION,
+                     'host': socket.gethostname(),
+                     'start': time(),
+                     'args': dict(args),
+                     'topology': {},
+                     'receiver': None,
+                     'flows': {},
+                     'phases': [],
+                     'captures': {},
+                     'files': {}}
+
+    def add_phase(self, name, start, end=None):
+        "Record a phase that ran from start until end (default: now)."
+        self.data['phases'].append({'name': name, 'start': start,
+                                    'seconds': (end or time()) - start})
+
+    @contextmanager
+    def phase(self, name):
+        "Record the wall-clock time spent in the enclosed block."
+        start = time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, start)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def add_flows(self, host, ip, hops, n, files):
+        "Record n flows from host, which is hops links away from the receiver."
+        self.data['flows'][host] = {'ip': ip, 'hops': hops, 'n': n,
+                                    'files': files}
+
+    def inventory(self):
+        "Return {relative path: size in bytes} for every file in outdir."
+        ret = {}
+        for root, _, files in os.walk(self.outdir):
+            for f in files:
+                path = os.path.join(root, f)
+                rel = os.path.relpath(path, self.outdir)
+                if rel != MANIFEST_NAME:
+                    ret[rel] = os.path.getsize(path)
+        return ret
+
+    def path(self):
+        return os.path.join(self.outdir, MANIFEST_NAME)
+
+    def write(self):
+        self.data['end'] = time()
+        self.data['files'] = self.inventory()
+        json.dump(self.data, open(self.path(), 'w'), indent=2, sort_keys=True)
+        return self.path()
+
+    def summary(self):
+        """Flat record for the sweep index: scalar args plus a few results."""
+        ret = dict((k, v) for k, v in self.data['args'].iteritems()
+                   if v is None or isinstance(v, (int, long, float, basestring)))
+        ret.update({'manifest': os.path.abspath(self.path()),
+                    'host': self.data['host'],
+                    'start': self.data['start'],
+                    'seconds': self.data.get('end', time()) - self.data['start'],
+                    'n_flows': sum(f['n'] for f in self.data['flows'].values()),
+                    'valid': all(c.get('valid', False) for c in
+                                 self.data['captures'].values())})
+        if 'fidelity' in self.data:
+            ret['faithful'] = self.data['fidelity']['faithful']
+            ret['valid'] = ret['valid'] and ret['faithful']
+        return ret
+
+
+def load(path):
+    """Load a manifest given its path or the run directory holding it."""
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    m = json.load(open(path))
+    m['dir'] = os.path.dirname(os.path.abspath(path))
+    return m
+
+
+def run_file(manifest, rel):
+    "Absolute path of a file listed in a loaded manifest."
+    return os.path.join(manifest['dir'], rel)
+
+
+def append_index(index_path, summary):
+    "Add one run to the sweep index."
+    f = open(index_path, 'a')
+    f.write(json.dumps(summary, sort_keys=True) + '\n')
+    f.close()
+
+
+def query_index(index_path, **where):
+    """Return index records whose fields equal the given values.  Values are
+       compared as strings so command-line filters match numbers too."""
+    ret = []
+    for line in open(index_path):
+        line = line.strip()
+        if not line:
+            continue
+        r = json.loads(line)
+        if all(str(r.get(k)) == str(v) for k, v in where.iteritems()):
+            ret.append(r)
+    return ret
+
+
+def main(argv):
+    if len(argv) < 2:
+        print 'Usage: %s <index.jsonl> [key=value ...]' % argv[0]
+        return 1
+    where = dict(a.split('=', 1) for a in argv[2:])
+    for r in query_index(argv[1], **where):
+        print r['manifest']
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
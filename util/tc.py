@@ -0,0 +1,65 @@
+from time import time
+from subprocess import Popen, PIPE, STDOUT
+import re
+
+# First line of each qdisc in `tc -s qdisc show`, e.g.
+#   qdisc tbf 8001: dev s0-eth1 root refcnt 2 rate 100Mbit burst 2500b lat 4.2s
+#   qdisc netem 10: dev s0-eth1 parent 1:1 limit 20
+pat_qdisc = re.compile(r'^qdisc\s+(\S+)\s+(\S+)\s+dev\s+(\S+)\s+(root|parent\s+\S+)')
+# Counters line that follows, e.g.
+#   Sent 1234 bytes 12 pkt (dropped 0, overlimits 3 requeues 0)
+pat_sent = re.compile(r'Sent (\d+) bytes (\d+) pkt \(dropped (\d+), '
+                      r'overlimits (\d+)')
+pat_backlog = re.compile(r'backlog\s+(\S+)\s+(\d+)p')
+
+
+def tc_batch(cmds, fname):
+    """Apply a list of tc commands (without the leading 'tc') in a single
+       `tc -batch` process.  The batch script is kept in @fname for reference.
+
+       Returns (exit code, elapsed seconds, tc output)."""
+    open(fname, 'w').write('\n'.join(cmds) + '\n')
+    start = time()
+    # -force keeps going past a failed command so every error is reported;
+    # the exit code is still nonzero if any command failed.
+    p = Popen(['tc', '-force', '-batch', fname], stdout=PIPE, stderr=STDOUT)
+    output = p.communicate()[0]
+    return p.returncode, time() - start, output
+
+
+def parse_qdisc_stats(output):
+    """Parse `tc -s qdisc show` output into {iface: [qdisc dict, ...]}.
+
+       Each dict has kind, handle, parent and, when present, the sent_bytes,
+       sent_pkts, dropped, overlimits and backlog_pkts counters."""
+    ret = {}
+    current = None
+    for line in output.split('\n'):
+        m = pat_qdisc.match(line)
+        if m:
+            kind, handle, iface, parent = m.groups()
+            current = {'kind': kind, 'handle': handle,
+                       'parent': parent.split()[-1],
+                       'line': line.strip()}
+            ret.setdefault(iface, []).append(current)
+            continue
+        if current is None:
+            continue
+        m = pat_sent.search(line)
+        if m:
+            current.update(zip(('sent_bytes', 'sent_pkts', 'dropped',
+                                'overlimits'),
+                               [int(x) for x in m.groups()]))
+        m = pat_backlog.search(line)
+        if m:
+            current['backlog_pkts'] = int(m.group(2))
+    return ret
+
+
+def qdisc_stats(dev=None):
+    """Read qdisc config and counters with one `tc -s qdisc show` call."""
+    cmd = ['tc', '-s', 'qdisc', 'show']
+    if dev:
+        cmd += ['dev', dev]
+    p = Popen(cmd, stdout=PIPE)
+    return parse_qdisc_stats(p.communicate()[0])
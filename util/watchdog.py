@@ -0,0 +1,210 @@
+from time import time
+from threading import Thread, Event
+import os
+import re
+
+from util.tc import qdisc_stats
+
+CGROUP_ROOTS = ['/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct',
+                '/sys/fs/cgroup']
+spaces = re.compile(r'\s+')
+
+
+def read_cpu_stat(host):
+    """Return (nr_periods, nr_throttled) for a CPULimitedHost's cgroup, or
+       None if the host has no CFS bandwidth cgroup."""
+    for root in CGROUP_ROOTS:
+        fname = os.path.join(root, host, 'cpu.stat')
+        if os.path.exists(fname):
+            stat = dict(line.split() for line in open(fname) if line.strip())
+            return int(stat.get('nr_periods', 0)), int(stat.get('nr_throttled', 0))
+    return None
+
+
+def read_tx_bytes(ifaces):
+    "Return {iface: tx bytes} from /proc/net/dev."
+    ret = {}
+    for line in open('/proc/net/dev').read().split('\n')[2:]:
+        line = spaces.split(line.replace(':', ' ').strip())
+        if line[0] in ifaces and len(line) > 9:
+            ret[line[0]] = int(line[9])
+    return ret
+
+
+class FidelityWatchdog(Thread):
+    """Samples emulation fidelity while an experiment runs.
+
+       Every interval_sec it records, per host, the fraction of CFS periods in
+       which the host was CPU throttled, and per switch interface the qdisc
+       drops and overlimits and the achieved tx rate.  A run is tagged
+       unfaithful once, for patience samples in a row, a host stays throttled
+       more than max_throttled, a link runs faster than
+       max_rate_ratio * bw_mbps, the bottleneck interface runs slower than
+       min_rate_ratio * bw_mbps during the first flow_sec seconds, or the
+       switch qdiscs hit more than max_overlimit_rate overlimits per second.
+       Zero or None disables the last two checks.  Qdisc drops are recorded
+       only: the experiment relies on tail drops at the bottleneck.  With
+       abort=True the aborted event is set at that point so the experiment
+       can stop early.  Each such episode is one entry in violations, with
+       its first and last bad sample times, its length in samples and the
+       reasons that tripped it."""
+
+    def __init__(self, hosts, ifaces, bw_mbps, fname, bottleneck=None,
+                 flow_sec=None, interval_sec=0.5, max_throttled=0.25,
+                 max_rate_ratio=1.1, min_rate_ratio=0.7,
+                 max_overlimit_rate=None, patience=3, abort=False):
+        Thread.__init__(self)
+        self.daemon = True
+        self.hosts = hosts
+        self.ifaces = ifaces
+        self.bw_mbps = bw_mbps
+        self.fname = fname
+        self.interval_sec = interval_sec
+        self.max_throttled = max_throttled
+        self.max_rate_ratio = max_rate_ratio
+        self.bottleneck = bottleneck
+        self.flow_sec = flow_sec
+        self.min_rate_ratio = min_rate_ratio
+        self.max_overlimit_rate = max_overlimit_rate
+        self.patience = patience
+        self.abort = abort
+        self.aborted = Event()
+        self._done = Event()
+        self.violations = []
+        self.samples = 0
+        self.worst = {'throttled': 0.0, 'rate_ratio': 0.0,
+                      'bottleneck_ratio': None, 'overlimit_rate': 0.0}
+        self.qdisc_drops = 0
+        self.qdisc_overlimits = 0
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def _qdisc_counters(self):
+        stats = qdisc_stats()
+        drops = overlimits = 0
+        for iface in self.ifaces:
+            for q in stats.get(iface, []):
+                drops += q.get('dropped', 0)
+                overlimits += q.get('overlimits', 0)
+        return drops, overlimits
+
+    def run(self):
+        out = open(self.fname, 'w')
+        out.write('#time,worst_host,throttled,worst_iface,mbps,'
+                  'bottleneck_mbps,qdisc_drops,qdisc_overlimits,'
+                  'overlimit_rate\n')
+        prev_cpu = dict((h, read_cpu_stat(h)) for h in self.hosts)
+        prev_tx = read_tx_bytes(self.ifaces)
+        drops0, overlimits0 = self._qdisc_counters()
+        prev_overlimits = overlimits0
+        start = prev_t = time()
+        bad_run = 0
+        bad_since = None
+        while not self._done.wait(self.interval_sec):
+            t = time()
+            dt = t - prev_t
+            prev_t = t
+
+            worst_host, throttled = None, 0.0
+            for h in self.hosts:
+                cur = read_cpu_stat(h)
+                prev = prev_cpu[h]
+                prev_cpu[h] = cur
+                if cur is None or prev is None or cur[0] == prev[0]:
+                    continue
+                frac = float(cur[1] - prev[1]) / (cur[0] - prev[0])
+                if frac >= throttled:
+                    worst_host, throttled = h, frac
+
+            tx = read_tx_bytes(self.ifaces)
+            worst_iface, mbps = None, 0.0
+            bottleneck_mbps = None
+            for iface, b in tx.iteritems():
+                rate = (b - prev_tx.get(iface, b)) * 8 / dt / 1e6
+                if rate >= mbps:
+                    worst_iface, mbps = iface, rate
+                if iface == self.bottleneck:
+                    bottleneck_mbps = rate
+            prev_tx = tx
+
+            drops, overlimits = self._qdisc_counters()
+            self.qdisc_drops = drops - drops0
+            self.qdisc_overlimits = overlimits - overlimits0
+            overlimit_rate = (overlimits - prev_overlimits) / dt
+            prev_overlimits = overlimits
+
+            out.write('%f,%s,%.3f,%s,%.2f,%s,%d,%d,%.1f\n' % (
+                t, worst_host, throttled, worst_iface, mbps,
+                '' if bottleneck_mbps is None else '%.2f' % bottleneck_mbps,
+                self.qdisc_drops, self.qdisc_overlimits, overlimit_rate))
+            self.samples += 1
+            ratio = mbps / self.bw_mbps
+            self.worst['throttled'] = max(self.worst['throttled'], throttled)
+            self.worst['rate_ratio'] = max(self.worst['rate_ratio'], ratio)
+            self.worst['overlimit_rate'] = max(self.worst['overlimit_rate'],
+                                               overlimit_rate)
+            # Flows have ended after flow_sec; the link may then go idle.
+            check_bottleneck = (self.min_rate_ratio and
+                                bottleneck_mbps is not None and
+                                (self.flow_sec is None or
+                                 t - start <= self.flow_sec))
+            if check_bottleneck:
+                bottleneck_ratio = bottleneck_mbps / self.bw_mbps
+                if self.worst['bottleneck_ratio'] is None:
+                    self.worst['bottleneck_ratio'] = bottleneck_ratio
+                self.worst['bottleneck_ratio'] = min(
+                    self.worst['bottleneck_ratio'], bottleneck_ratio)
+
+            reasons = []
+            if throttled > self.max_throttled:
+                reasons.append('%s throttled in %.0f%% of periods' % (
+                    worst_host, 100 * throttled))
+            if ratio > self.max_rate_ratio:
+                reasons.append('%s at %.1fMbps on a %sMbps link' % (
+                    worst_iface, mbps, self.bw_mbps))
+            if check_bottleneck and bottleneck_ratio < self.min_rate_ratio:
+                reasons.append('bottleneck %s at %.1fMbps on a %sMbps link' % (
+                    self.bottleneck, bottleneck_mbps, self.bw_mbps))
+            if (self.max_overlimit_rate and
+                overlimit_rate > self.max_overlimit_rate):
+                reasons.append('%.0f qdisc overlimits/s' % overlimit_rate)
+            if not reasons:
+                bad_run = 0
+                continue
+            bad_run += 1
+            if bad_run == 1:
+                bad_since = t
+            if bad_run == self.patience:
+                self.violations.append({'start': bad_since, 'end': t,
+                                        'samples': bad_run,
+                                        'reasons': reasons})
+                if self.abort:
+                    self.aborted.set()
+            elif bad_run > self.patience:
+                self.violations[-1]['end'] = t
+                self.violations[-1]['samples'] = bad_run
+        out.close()
+
+    def faithful(self):
+        return not self.violations
+
+    def summary(self):
+        "Fidelity section for the run manifest."
+        return {'faithful': self.faithful(),
+                'aborted': self.aborted.is_set(),
+                'samples': self.samples,
+                'worst_throttled': self.worst['throttled'],
+                'worst_rate_ratio': self.worst['rate_ratio'],
+                'worst_bottleneck_ratio': self.worst['bottleneck_ratio'],
+                'worst_overlimit_rate': self.worst['overlimit_rate'],
+                'qdisc_drops': self.qdisc_drops,
+                'qdisc_overlimits': self.qdisc_overlimits,
+                'n_violations': len(self.violations),
+                'violations': self.violations[:20],
+                'thresholds': {'max_throttled': self.max_throttled,
+                               'max_rate_ratio': self.max_rate_ratio,
+                               'min_rate_ratio': self.min_rate_ratio,
+                               'max_overlimit_rate': self.max_overlimit_rate,
+                               'patience': self.patience}}